@@ -0,0 +1,205 @@
+'''
+Runs EXPLAIN on every query in db.py against a seeded database, and fails if any query reads a
+large table with a sequential scan, i.e. if a query is missing an index.
+
+Every public function in db.py is called with arguments that match the seeded data. Their queries
+are explained and then run, and everything they change is rolled back afterwards.
+
+Examples, run from the repository's root folder:
+    python -m benchmark.explain --docker
+    python -m benchmark.explain --seed-db
+
+Without --docker the database configured in the environment, as for db.py, is used.
+'''
+import argparse
+import importlib
+import inspect
+import json
+import sys
+from contextlib import contextmanager
+from datetime import datetime
+from benchmark import mock_spotify, seed
+
+# Functions in db.py that don't run any queries
+no_queries = {'init_pool', 'get_cursor', 'escape_like'}
+# Functions that read a whole table by design, so a sequential scan is what they should do
+full_scans = {'load_track_catalog': {'track_catalog'}, 'load_genre_tracks': {'genre_track'}}
+
+
+class ExplainingCursor:
+    ''' Wraps a cursor so the plan of every query is recorded before the query is run. '''
+
+    def __init__(self, cur, plans):
+        self.cur = cur
+        self.plans = plans
+
+    def explain(self, query, params):
+        self.cur.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+        plan = self.cur.fetchone()[0]
+        # psycopg2 only parses the JSON itself if the server says the column is json
+        self.plans.append(json.loads(plan) if isinstance(plan, str) else plan)
+
+    def execute(self, query, params=None):
+        self.explain(query, params)
+        self.cur.execute(query, params)
+
+    def executemany(self, query, params_list):
+        params_list = list(params_list)
+        if params_list:
+            self.explain(query, params_list[0])
+        self.cur.executemany(query, params_list)
+
+    def __getattr__(self, name):
+        return getattr(self.cur, name)
+
+
+def seq_scans(plan):
+    ''' Returns the names of the tables a plan reads with a sequential scan. '''
+    tables = set()
+    nodes = [step['Plan'] for step in plan]
+    while nodes:
+        node = nodes.pop()
+        if node.get('Node Type') == 'Seq Scan':
+            tables.add(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return tables
+
+
+def cases(db_users, playlists_per_user):
+    '''
+    Returns the arguments every function in db.py is called with, as lists of argument tuples
+    mapped to the functions' names. Users 1, 2 and 3 are picked from the seeded users.
+    '''
+    user, other, third = seed.user_id(1), seed.user_id(2), seed.user_id(3)
+    playlists = mock_spotify.playlist_ids(user, playlists_per_user)
+    genre = mock_spotify.genres[0]
+    catalog_track = ('spotify:track:explain', 1999, 50, 0.1)
+    genre_track = (genre, 'spotify:track:explain', 50, 0.1, 0.5, 0.5, 0.5, 0.5, 0.5)
+    return {
+        'check_user_in_db': [(user,)],
+        'search_users': [(seed.user_id(db_users // 10 + 3),), (seed.user_id(db_users // 10 + 3), 20, 20)],
+        'become_friends': [(user, third)],
+        'check_if_friends': [(user, other)],
+        'remove_friend': [(user, other)],
+        'list_friends': [(user,)],
+        'friend_suggestions': [(user, 10)],
+        'register_user': [(user, 'Bench user'), ('explainuser', None)],
+        'delete_user': [(user,)],
+        'add_playlist': [('explainplaylist', 'spotify:playlist:explainplaylist', user, 'Explain')],
+        'generated_playlist_info': [(playlists[0], 'Explain', 10, datetime.now())],
+        'check_if_playlist_is_own': [(playlists[0],)],
+        'check_playlist': [(user,)],
+        'sync_playlist_names': [(user, {pl_id: f'Playlist {pl_id}' for pl_id in playlists[1:]})],
+        'delete_playlist': [(playlists[0],)],
+        'save_user_bio': [(user, 'Explain')],
+        'get_user_bio': [(user,)],
+        'get_user_r_date': [(user,)],
+        'load_profile': [(user, other, 20)],
+        'get_top_items_snapshot': [(user, 'tracks', 'short_term')],
+        'save_top_items_snapshot': [(user, 'tracks', 'short_term', ['spotify:track:explain'])],
+        'load_track_catalog': [()],
+        'save_catalog_tracks': [([catalog_track],)],
+        'load_genre_tracks': [()],
+        'save_genre_tracks': [([genre_track],)],
+        'comment_user': [(other, user, 'Explain')],
+        'get_user_comments': [(user, 20), (user, 20, (datetime.now(), 2 ** 31 - 1))],
+        'remove_comment': [(1, user)],
+    }
+
+
+def explain(db, conn, function_cases, min_rows):
+    '''
+    Calls every function in db.py with its cases and checks the plans of their queries.
+
+    Parameters:
+        - db: The db module.
+        - conn: A psycopg2 connection to the seeded database, used for every query.
+        - function_cases (dict): The cases returned by cases.
+        - min_rows (int): Tables with at least this many rows count as large.
+    Returns:
+        - A list of problems, empty if every query is served by indexes.
+    '''
+    with conn.cursor() as cur:
+        cur.execute("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace")
+        large_tables = {table for table, rows in cur.fetchall() if rows >= min_rows}
+    conn.rollback()
+
+    plans = []
+
+    @contextmanager
+    def explaining_cursor():
+        with conn.cursor() as cur:
+            yield ExplainingCursor(cur, plans)
+
+    functions = [name for name, function in inspect.getmembers(db, inspect.isfunction)
+                 if function.__module__ == db.__name__ and not name.startswith('_') and name not in no_queries]
+    problems = [f"{name}: no case, add one to benchmark/explain.py" for name in functions if name not in function_cases]
+
+    original_get_cursor = db.get_cursor
+    db.get_cursor = explaining_cursor
+    try:
+        for name in functions:
+            for args in function_cases.get(name, []):
+                plans.clear()
+                try:
+                    getattr(db, name)(*args)
+                except Exception as error:
+                    problems.append(f"{name}{args}: {type(error).__name__}: {error}")
+                finally:
+                    conn.rollback()
+                if not plans:
+                    problems.append(f"{name}{args}: ran no queries")
+                for plan in plans:
+                    for table in sorted((seq_scans(plan) & large_tables) - full_scans.get(name, set())):
+                        problems.append(f"{name}: sequential scan on {table}")
+                print(f"{name}: {len(plans)} queries explained")
+    finally:
+        db.get_cursor = original_get_cursor
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark.explain',
+                                     description='Checks that every query in db.py is served by indexes on a seeded database.')
+    parser.add_argument('--docker', action='store_true', help='start a throwaway Postgres container and seed it')
+    parser.add_argument('--docker-port', type=int, default=5433)
+    parser.add_argument('--create-schema', action='store_true', help='apply the migrations to the database and seed it')
+    parser.add_argument('--seed-db', action='store_true', help='seed the database before checking')
+    parser.add_argument('--seed', type=int, default=0, help='seeds the database')
+    parser.add_argument('--db-users', type=int, default=10000)
+    parser.add_argument('--playlists-per-user', type=int, default=10)
+    parser.add_argument('--min-rows', type=int, default=1000,
+                        help='tables with at least this many rows must not be read with a sequential scan')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    container = seed.start_container(args.docker_port) if args.docker else None
+    try:
+        conn = seed.connect()
+        try:
+            if args.docker or args.create_schema:
+                seed.create_schema(conn)
+            if args.docker or args.create_schema or args.seed_db:
+                seed.seed(conn, users=args.db_users, playlists_per_user=args.playlists_per_user, seed=args.seed)
+            # Imported here so it reads the database settings set by start_container
+            db = importlib.import_module('db')
+            problems = explain(db, conn, cases(args.db_users, args.playlists_per_user), args.min_rows)
+        finally:
+            conn.close()
+    finally:
+        if container:
+            seed.stop_container(container)
+
+    if problems:
+        print(f"\n{len(problems)} problems:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    print("\nEvery query is served by indexes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+import functools
+import random
+import threading
+import time
+import uuid
+from flask import Flask, jsonify, request
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# The number of tracks in the mock's catalog. Track n has the ID 'track<n>'.
+track_count = 100000
+# The genres returned by the available-genre-seeds endpoint
+genres = ['acoustic', 'blues', 'classical', 'country', 'dance', 'disco', 'electronic', 'folk', 'funk', 'hip-hop',
+          'indie', 'jazz', 'metal', 'pop', 'punk', 'r-n-b', 'reggae', 'rock', 'soul', 'swedish']
+first_year = 1920
+last_year = 2024
+
+
+def track(n):
+    '''
+    Returns track n of the mock's catalog as a Spotify track object.
+    The same n always gives the same track, so the database can be seeded with tracks the mock knows.
+    '''
+    rng = random.Random(n)
+    year = rng.randint(first_year, last_year)
+    return {
+        'id': f'track{n}',
+        'uri': f'spotify:track:track{n}',
+        'name': f'Track {n}',
+        'popularity': rng.randint(0, 100),
+        'artists': [{'id': f'artist{n % 5000}', 'name': f'Artist {n % 5000}'}],
+        'album': {'name': f'Album {n // 12}', 'release_date': f'{year}-01-01',
+                  'images': [{'url': f'https://i.scdn.co/image/album{n // 12}'}]},
+    }
+
+
+@functools.lru_cache(maxsize=1)
+def release_years():
+    ''' Returns the release year of every track in the catalog, indexed by track number. '''
+    return [int(track(n)['album']['release_date'][:4]) for n in range(track_count)]
+
+
+def track_genre(n):
+    ''' Returns the genre of track n, which is the genre of its artist. '''
+    return genres[n % 5000 % len(genres)]
+
+
+def audio_features(n):
+    ''' Returns the audio features of track n. '''
+    rng = random.Random(-n - 1)
+    return {'id': f'track{n}', 'uri': f'spotify:track:track{n}', 'speechiness': round(rng.random() ** 3, 3),
+            'danceability': round(rng.random(), 3), 'energy': round(rng.random(), 3), 'valence': round(rng.random(), 3),
+            'acousticness': round(rng.random(), 3), 'instrumentalness': round(rng.random() ** 2, 3)}
+
+
+def track_number(track_id):
+    return int(track_id.rsplit(':', 1)[-1][len('track'):])
+
+
+def user(user_id):
+    ''' Returns a Spotify user object. '''
+    return {'id': user_id, 'display_name': f'Bench {user_id}', 'type': 'user',
+            'images': [{'url': f'https://i.scdn.co/image/{user_id}'}]}
+
+
+def playlist_ids(user_id, count):
+    ''' Returns the IDs of the playlists a user has on Spotify before any are created. '''
+    return [f'{user_id}pl{i}' for i in range(count)]
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    ''' Doesn't log every request, which would drown the benchmark's output. '''
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class MockSpotify:
+    '''
+    A stand-in for the Spotify Web API and accounts service, run in a thread of the benchmark.
+    It answers the endpoints main.py uses with generated data after a random delay, and answers
+    429 with a Retry-After header when Web API requests come in faster than the rate limit.
+
+    Parameters:
+        - latency (float): The mean delay of every response, in seconds.
+        - jitter (float): The standard deviation of the delay, in seconds.
+        - rate_limit (float): The number of requests per second allowed before answering 429, or None for no limit.
+        - playlists_per_user (int): The number of playlists every user has on Spotify.
+        - playlist_length (int): The number of tracks in every playlist that wasn't created during the benchmark.
+        - token_lifetime (int): Seconds until an access token expires.
+        - recommendations (bool): Whether the recommendations and genre seed endpoints exist.
+          Spotify has removed them for new apps.
+        - seed (int): Seeds the random delays and recommendations, so runs can be repeated.
+    '''
+
+    def __init__(self, latency=0.05, jitter=0.01, rate_limit=None, playlists_per_user=10,
+                 playlist_length=200, token_lifetime=3600, recommendations=True, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.playlists_per_user = playlists_per_user
+        self.playlist_length = playlist_length
+        self.token_lifetime = token_lifetime
+        self.recommendations = recommendations
+        self.random = random.Random(seed)
+        self.tokens = {}
+        self.refresh_tokens = {}
+        self.created_playlists = {}
+        self.playlist_tracks = {}
+        self.requests = {}
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+        self._allowance = rate_limit or 0
+        self._last_check = time.monotonic()
+        self._server = None
+        self.app = self._create_app()
+
+    def start(self, host='127.0.0.1', port=0):
+        ''' Starts serving in a background thread and returns the URL of the server. '''
+        self._server = make_server(host, port, self.app, threaded=True, request_handler=QuietRequestHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self._server.server_port}/'
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _delay(self):
+        with self._lock:
+            delay = self.random.gauss(self.latency, self.jitter)
+        time.sleep(max(delay, 0))
+
+    def _allow(self):
+        ''' Token bucket rate limiting: the bucket holds at most one second of requests. '''
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self._allowance + (now - self._last_check) * self.rate_limit, self.rate_limit)
+            self._last_check = now
+            if self._allowance < 1:
+                self.rate_limited += 1
+                return False
+            self._allowance -= 1
+            return True
+
+    def _user(self):
+        token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        with self._lock:
+            user_id, expires_at = self.tokens.get(token, (None, 0))
+        return user_id if expires_at > time.time() else None
+
+    def _new_token(self, user_id):
+        access_token = uuid.uuid4().hex
+        refresh_token = uuid.uuid4().hex
+        with self._lock:
+            self.tokens[access_token] = (user_id, time.time() + self.token_lifetime)
+            self.refresh_tokens[refresh_token] = user_id
+        return {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': self.token_lifetime,
+                'refresh_token': refresh_token, 'scope': request.form.get('scope', '')}
+
+    def _tracks_of(self, playlist_id):
+        with self._lock:
+            if playlist_id in self.playlist_tracks:
+                return list(self.playlist_tracks[playlist_id])
+        start = sum(map(ord, playlist_id)) * 97 % track_count
+        return [f'spotify:track:track{(start + i) % track_count}' for i in range(self.playlist_length)]
+
+    def _next_url(self, offset, limit, total):
+        if offset + limit >= total:
+            return None
+        args = dict(request.args, offset=offset + limit, limit=limit)
+        return request.base_url + '?' + '&'.join(f'{key}={value}' for key, value in args.items())
+
+    def _create_app(self):
+        app = Flask(__name__)
+        # spotipy asks for e.g. 'me/' with a trailing slash
+        app.url_map.strict_slashes = False
+
+        @app.before_request
+        def before():
+            rule = request.url_rule.rule if request.url_rule else 'unmatched'
+            with self._lock:
+                self.requests[rule] = self.requests.get(rule, 0) + 1
+            # Like Spotify, only the Web API is rate limited, not the accounts service
+            if request.path.startswith('/v1/') and not self._allow():
+                return jsonify({'error': {'status': 429, 'message': 'API rate limit exceeded'}}), 429, {'Retry-After': '1'}
+            self._delay()
+            if request.path.startswith('/v1/') and self._user() is None:
+                return jsonify({'error': {'status': 401, 'message': 'The access token expired'}}), 401
+            if request.path.startswith('/v1/recommendations') and not self.recommendations:
+                return jsonify({'error': {'status': 404, 'message': 'Service not found'}}), 404
+
+        @app.post('/api/token')
+        def token():
+            if request.form.get('grant_type') == 'refresh_token':
+                with self._lock:
+                    user_id = self.refresh_tokens.pop(request.form.get('refresh_token'), None)
+                if user_id is None:
+                    return jsonify({'error': 'invalid_grant'}), 400
+                return jsonify(self._new_token(user_id))
+            if request.form.get('grant_type') == 'client_credentials':
+                # A token of the app itself, which belongs to no user
+                return jsonify(self._new_token(''))
+            # The benchmark logs in with the user's ID as the authorization code
+            return jsonify(self._new_token(request.form['code']))
+
+        @app.get('/v1/me')
+        def me():
+            return jsonify(user(self._user()))
+
+        @app.get('/v1/users/<user_id>')
+        def get_user(user_id):
+            return jsonify(user(user_id))
+
+        @app.get('/v1/users/<user_id>/playlists')
+        def user_playlists(user_id):
+            limit = request.args.get('limit', 20, type=int)
+            offset = request.args.get('offset', 0, type=int)
+            with self._lock:
+                created = list(self.created_playlists.get(user_id, []))
+            playlists = [{'id': pl_id, 'name': f'Playlist {pl_id}'} for pl_id in playlist_ids(user_id, self.playlists_per_user)] + created
+            return jsonify({'items': playlists[offset:offset + limit], 'total': len(playlists),
+                            'next': self._next_url(offset, limit, len(playlists))})
+
+        @app.post('/v1/users/<user_id>/playlists')
+        def create_playlist(user_id):
+            playlist_id = uuid.uuid4().hex[:22]
+            playlist = {'id': playlist_id, 'name': request.json['name'], 'uri': f'spotify:playlist:{playlist_id}'}
+            with self._lock:
+                self.created_playlists.setdefault(user_id, []).append(playlist)
+                self.playlist_tracks[playlist_id] = []
+            return jsonify(dict(playlist, tracks={'href': request.url + '/tracks', 'total': 0})), 201
+
+        @app.get('/v1/playlists/<playlist_id>')
+        def playlist(playlist_id):
+            return jsonify({'id': playlist_id, 'name': f'Playlist {playlist_id}', 'uri': f'spotify:playlist:{playlist_id}'})
+
+        # Newer versions of spotipy use the items endpoints instead of the deprecated tracks endpoints
+        @app.get('/v1/playlists/<playlist_id>/items')
+        @app.get('/v1/playlists/<playlist_id>/tracks')
+        def playlist_tracks(playlist_id):
+            limit = request.args.get('limit', 100, type=int)
+            offset = request.args.get('offset', 0, type=int)
+            uris = self._tracks_of(playlist_id)
+            return jsonify({'items': [{'track': track(track_number(uri))} for uri in uris[offset:offset + limit]],
+                            'total': len(uris), 'next': self._next_url(offset, limit, len(uris))})
+
+        @app.post('/v1/playlists/<playlist_id>/items')
+        @app.post('/v1/playlists/<playlist_id>/tracks')
+        def add_tracks(playlist_id):
+            # spotipy sends the URIs as a list, the API documents an object with a uris list
+            uris = request.json['uris'] if isinstance(request.json, dict) else request.json
+            if len(uris) > 100:
+                return jsonify({'error': {'status': 400, 'message': 'Too many ids requested'}}), 400
+            with self._lock:
+                self.playlist_tracks.setdefault(playlist_id, []).extend(uris)
+            return jsonify({'snapshot_id': uuid.uuid4().hex}), 201
+
+        @app.get('/v1/me/top/<item_type>')
+        def top_items(item_type):
+            limit = request.args.get('limit', 20, type=int)
+            rng = random.Random(f"{self._user()}{request.args.get('time_range')}")
+            numbers = rng.sample(range(track_count), limit)
+            if item_type == 'artists':
+                items = [{'id': f'artist{n % 5000}', 'name': f'Artist {n % 5000}', 'genres': [genres[n % len(genres)]]} for n in numbers]
+            else:
+                items = [track(n) for n in numbers]
+            return jsonify({'items': items, 'total': limit, 'next': None})
+
+        @app.get('/v1/recommendations/available-genre-seeds')
+        def genre_seeds():
+            return jsonify({'genres': genres})
+
+        @app.get('/v1/recommendations')
+        def recommendations():
+            limit = request.args.get('limit', 20, type=int)
+            with self._lock:
+                numbers = self.random.sample(range(track_count), limit)
+            return jsonify({'tracks': [track(n) for n in numbers], 'seeds': []})
+
+        @app.get('/v1/search')
+        def search():
+            # Only the year and genre searches made by the playlist generators are supported
+            query = request.args['q']
+            if query.startswith('genre:'):
+                genre = query.removeprefix('genre:').strip('"')
+                matches = lambda n: track_genre(n) == genre
+            else:
+                start_year, end_year = map(int, query.removeprefix('year:').split('-'))
+                years = release_years()
+                matches = lambda n: start_year <= years[n] <= end_year
+            limit = request.args.get('limit', 10, type=int)
+            offset = request.args.get('offset', 0, type=int)
+            rng = random.Random(query)
+            items = []
+            n = rng.randrange(track_count)
+            skipped = 0
+            while len(items) < limit and skipped < track_count:
+                if matches(n):
+                    if offset:
+                        offset -= 1
+                    else:
+                        items.append(track(n))
+                n = (n + 1) % track_count
+                skipped += 1
+            return jsonify({'tracks': {'items': items, 'total': 1000, 'limit': limit, 'next': None}})
+
+        @app.get('/v1/tracks')
+        def tracks():
+            return jsonify({'tracks': [track(track_number(track_id)) for track_id in request.args['ids'].split(',')]})
+
+        @app.get('/v1/audio-features')
+        def get_audio_features():
+            return jsonify({'audio_features': [audio_features(track_number(track_id)) for track_id in request.args['ids'].split(',')]})
+
+        return app
@@ -0,0 +1,370 @@
+'''
+Runs main.py's Flask app against the mock Spotify server and a seeded Postgres database,
+with a number of virtual users going through the site's scenarios at the same time,
+and reports the throughput and the p50/p95/p99 latency of every route.
+
+Examples, run from the repository's root folder:
+    python -m benchmark --docker --save baseline.json
+    python -m benchmark --docker --compare baseline.json
+    python -m benchmark --seed-db --users 50 --duration 120 --latency 0.1 --rate-limit 200
+    python -m benchmark --docker --sweep-playlists-per-user 10 100 1000 --duration 30
+
+Without --docker the database configured in the environment, as for db.py, is used.
+'''
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from benchmark import mock_spotify, seed
+
+# How often a virtual user picks each scenario
+default_weights = {
+    'login': 2,
+    'home': 10,
+    'profile': 25,
+    'own_profile': 10,
+    'playlists': 15,
+    'playlist_page': 15,
+    'user_search': 10,
+    'top_items': 13,
+    'generate_genres': 5,
+    'generate_decades': 5,
+}
+# Seconds between polls of a generation job's status. Shorter than in static/script.js,
+# so that the time until the playlist is ready is measured more precisely.
+job_poll_interval = 0.1
+# Seconds before a generation job that hasn't finished counts as an error
+job_timeout = 120
+
+# The route sweep_playlists measures
+playlists_page = 'GET /profile-page/<username>/playlists'
+
+
+class Recorder:
+    ''' Collects the latency and outcome of every request made by the virtual users. '''
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def add(self, label, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(label, []).append((seconds, ok))
+
+    def summary(self, elapsed):
+        '''
+        Returns the number of requests, errors, requests per second and the p50, p95 and
+        p99 latency in milliseconds of every route.
+        '''
+        with self._lock:
+            samples = {label: list(values) for label, values in self.samples.items()}
+        routes = {}
+        for label, values in sorted(samples.items()):
+            latencies = sorted(seconds for seconds, ok in values)
+            routes[label] = {
+                'requests': len(values),
+                'errors': sum(1 for seconds, ok in values if not ok),
+                'throughput': len(values) / elapsed,
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+            }
+        return routes
+
+
+def percentile(sorted_values, p):
+    ''' Returns the p:th percentile of sorted values with the nearest-rank method. '''
+    if not sorted_values:
+        return 0
+    rank = max(math.ceil(len(sorted_values) * p / 100), 1)
+    return sorted_values[rank - 1]
+
+
+class VirtualUser:
+    '''
+    One logged-in user clicking through the site with their own test client and session cookie.
+
+    Parameters:
+        - app (Flask): main.py's app.
+        - n (int): The number of the seeded user to log in as.
+        - db_users (int): The number of seeded users, to pick other users' profiles from.
+        - playlists_per_user (int): The number of seeded playlists of every user.
+        - recorder (Recorder): Where the requests are recorded.
+        - rng (Random): Decides which scenarios are run and with what arguments.
+    '''
+
+    def __init__(self, app, n, db_users, playlists_per_user, recorder, rng):
+        self.app = app
+        self.user_id = seed.user_id(n)
+        self.db_users = db_users
+        self.playlists_per_user = playlists_per_user
+        self.recorder = recorder
+        self.rng = rng
+        self.client = None
+
+    def request(self, label, method, url, succeeded=None, **kwargs):
+        '''
+        Makes a request and records how long it took. It counts as an error if the status code
+        is 400 or more, or if succeeded is given and returns False for the response.
+        '''
+        started = time.perf_counter()
+        try:
+            response = self.client.open(url, method=method, **kwargs)
+            ok = response.status_code < 400 and (succeeded is None or succeeded(response))
+        except Exception:
+            response = None
+            ok = False
+        self.recorder.add(label, time.perf_counter() - started, ok)
+        return response
+
+    def logged_in(self):
+        if self.client is None:
+            return False
+        with self.client.session_transaction() as session:
+            return 'user_id' in session
+
+    def login(self):
+        # Skips Spotify's authorization page: the mock accepts the user's ID as the authorization code.
+        # The callback redirects home whether the login worked or not, so the session is checked.
+        self.client = self.app.test_client()
+        self.request('GET /callback', 'GET', f'/callback?code={self.user_id}', succeeded=lambda response: self.logged_in())
+
+    def home(self):
+        self.request('GET /', 'GET', '/')
+
+    def profile(self):
+        other = seed.user_id(self.rng.randrange(self.db_users))
+        self.request('GET /profile-page/<username>', 'GET', f'/profile-page/{other}')
+
+    def own_profile(self):
+        self.request('GET /profile-page', 'GET', '/profile-page')
+        self.request('GET /profile-page/<username>', 'GET', f'/profile-page/{self.user_id}')
+
+    def playlists(self):
+        self.request(playlists_page, 'GET', f'/profile-page/{self.user_id}/playlists')
+
+    def playlist_page(self):
+        pl_id = self.rng.choice(mock_spotify.playlist_ids(self.user_id, self.playlists_per_user))
+        self.request('GET /playlist/<pl_id>', 'GET', f'/playlist/{pl_id}')
+        self.request('GET /playlist/<pl_id>/tracks', 'GET', f'/playlist/{pl_id}/tracks?offset=50&limit=50')
+
+    def user_search(self):
+        search = f'benchuser{self.rng.randrange(self.db_users)}'[:self.rng.randint(6, 12)]
+        self.request('POST /users', 'POST', '/users', data={'search_user': search})
+
+    def top_items(self):
+        item_type = self.rng.choice(['artists', 'tracks'])
+        time_range = self.rng.choice(['short_term', 'medium_term', 'long_term'])
+        self.request('GET /top/<item_type>', 'GET', f'/top/{item_type}?time_range={time_range}')
+
+    def generate_genres(self):
+        genres = self.rng.sample(mock_spotify.genres, self.rng.randint(1, 5))
+        self.generate('genres', '/recommendations', {'genres': genres, 'recco_limit': self.rng.choice([20, 50, 100])})
+
+    def generate_decades(self):
+        decades = self.rng.sample(['1960s', '1970s', '1980s', '1990s', '2000s', '2010s'], self.rng.randint(1, 3))
+        self.generate('years', '/search', {'decades': decades, 'search_limit': self.rng.choice([20, 50, 100])})
+
+    def generate(self, method, url, data):
+        ''' Creates a playlist, starts generating it and polls the job until it is done. '''
+        self.request('POST /generate-playlist', 'POST', '/generate-playlist',
+                     data={'playlist_name': 'Benchmark', 'playlist_description': '', 'generate-method': method})
+        started = time.perf_counter()
+        response = self.request(f'POST {url}', 'POST', url, json=data)
+        if response is None or response.status_code != 202:
+            return
+        status_url = response.json['status_url']
+        status = None
+        while status not in ('done', 'failed') and time.perf_counter() - started < job_timeout:
+            time.sleep(job_poll_interval)
+            response = self.request('GET /jobs/<job_id>', 'GET', status_url)
+            status = response.json['status'] if response is not None and response.status_code == 200 else 'failed'
+        # The time until the playlist was ready, as the user sees it
+        self.recorder.add(f'job: generate {method}', time.perf_counter() - started, status == 'done')
+
+    def run(self, weights, deadline):
+        scenarios = list(weights)
+        while time.monotonic() < deadline:
+            if not self.logged_in():
+                self.login()
+                continue
+            scenario = self.rng.choices(scenarios, [weights[name] for name in scenarios])[0]
+            getattr(self, scenario)()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmark', description=__doc__.split('\n\n')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=20, help='virtual users clicking through the site at the same time')
+    parser.add_argument('--duration', type=float, default=60, help='seconds to run')
+    parser.add_argument('--scenarios', nargs='+', choices=default_weights, default=list(default_weights),
+                        help='the scenarios to run, picked with their default weights')
+    parser.add_argument('--seed', type=int, default=0, help='seeds the database, the mock and the virtual users')
+    parser.add_argument('--latency', type=float, default=0.05, help='mean latency of the mock Spotify server in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='standard deviation of the mock latency in seconds')
+    parser.add_argument('--rate-limit', type=float, help='requests per second the mock allows before answering 429')
+    parser.add_argument('--token-lifetime', type=int, default=3600, help='seconds until the mock\'s access tokens expire')
+    parser.add_argument('--no-recommendations', action='store_true',
+                        help='make the mock answer 404 to the recommendations endpoints, like Spotify does for new apps')
+    parser.add_argument('--docker', action='store_true', help='start a throwaway Postgres container and seed it')
+    parser.add_argument('--docker-port', type=int, default=5433)
+    parser.add_argument('--create-schema', action='store_true', help='apply the migrations to the database and seed it')
+    parser.add_argument('--seed-db', action='store_true', help='seed the database before running')
+    parser.add_argument('--db-users', type=int, default=10000)
+    parser.add_argument('--friends-per-user', type=int, default=20)
+    parser.add_argument('--comments-per-user', type=int, default=30)
+    parser.add_argument('--playlists-per-user', type=int, default=10)
+    parser.add_argument('--sweep-playlists-per-user', type=int, nargs='+', metavar='COUNT',
+                        help='run only the playlists scenario once for every number of playlists per user, '
+                             'reseeding the playlists in between, and report how the playlists page scales')
+    parser.add_argument('--catalog-tracks', type=int, default=20000)
+    parser.add_argument('--genre-tracks', type=int, default=500)
+    parser.add_argument('--save', metavar='FILE', help='save the results as JSON, e.g. as a baseline')
+    parser.add_argument('--compare', metavar='FILE', help='compare the results with results saved with --save')
+    return parser.parse_args(argv)
+
+
+def prepare_database(args):
+    ''' Starts, creates and seeds the database as asked, and returns the container's ID if one was started. '''
+    container = seed.start_container(args.docker_port) if args.docker else None
+    if args.docker or args.create_schema or args.seed_db:
+        conn = seed.connect()
+        try:
+            if args.docker or args.create_schema:
+                seed.create_schema(conn)
+            seed.seed(conn, users=args.db_users, friends_per_user=args.friends_per_user,
+                      comments_per_user=args.comments_per_user, playlists_per_user=args.playlists_per_user,
+                      catalog_tracks=args.catalog_tracks, genre_tracks=args.genre_tracks, seed=args.seed)
+        finally:
+            conn.close()
+    return container
+
+
+def load_app(spotify_url):
+    ''' Imports main.py configured to use the mock Spotify server, and returns its Flask app. '''
+    os.environ.update(spotify_api_url=spotify_url + 'v1/', spotify_accounts_url=spotify_url,
+                      client_id='benchmark', client_secret='benchmark', redirect_uri='http://localhost/callback')
+    os.environ.setdefault('FLASK_SECRET_KEY', 'benchmark')
+    return importlib.import_module('main').app
+
+
+def run(app, args):
+    ''' Runs the virtual users until the duration is over and returns the recorded requests and the elapsed time. '''
+    recorder = Recorder()
+    weights = {name: default_weights[name] for name in args.scenarios}
+    deadline = time.monotonic() + args.duration
+    virtual_users = [VirtualUser(app, n, args.db_users, args.playlists_per_user, recorder, random.Random(args.seed * 100003 + n))
+                     for n in range(args.users)]
+    threads = [threading.Thread(target=user.run, args=(weights, deadline)) for user in virtual_users]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.perf_counter() - started
+
+
+def sweep_playlists(app, mock, args):
+    '''
+    Runs the playlists scenario once for every number of playlists per user in args.sweep_playlists_per_user.
+    The page is rendered from the database, so its latency should stay flat as the number grows.
+
+    Returns:
+        - The playlists page's results for every number, or None for a number where it got no requests.
+    '''
+    results = {}
+    for count in args.sweep_playlists_per_user:
+        if args.docker or args.create_schema or args.seed_db:
+            conn = seed.connect()
+            try:
+                seed.seed_playlists(conn, args.db_users, count)
+            finally:
+                conn.close()
+        mock.playlists_per_user = count
+        sweep_args = argparse.Namespace(**{**vars(args), 'playlists_per_user': count, 'scenarios': ['playlists']})
+        recorder, elapsed = run(app, sweep_args)
+        results[count] = recorder.summary(elapsed).get(playlists_page)
+        print(f"{count} playlists per user: done")
+    return results
+
+
+def report_sweep(results):
+    ''' Prints the results of sweep_playlists as a table. '''
+    header = f"{'playlists':>9} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(f"\n{playlists_page}")
+    print(header)
+    print('-' * len(header))
+    for count, route in results.items():
+        if route is None:
+            print(f"{count:>9} {0:>8}")
+            continue
+        print(f"{count:>9} {route['requests']:>8} {route['errors']:>6} {route['throughput']:>7.1f} "
+              f"{route['p50']:>8.1f} {route['p95']:>8.1f} {route['p99']:>8.1f}")
+
+
+def report(routes, baseline=None):
+    ''' Prints the results as a table, with the change from the baseline if there is one. '''
+    header = f"{'route':<42} {'requests':>8} {'errors':>6} {'req/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print('-' * len(header))
+    for label, route in routes.items():
+        print(f"{label:<42} {route['requests']:>8} {route['errors']:>6} {route['throughput']:>7.1f} "
+              f"{route['p50']:>8.1f} {route['p95']:>8.1f} {route['p99']:>8.1f}")
+        old = (baseline or {}).get(label)
+        if old:
+            changes = [f"{key} {change(old[key], route[key])}" for key in ('throughput', 'p50', 'p95', 'p99')]
+            print(f"{'':<42} vs baseline: {', '.join(changes)}")
+
+
+def change(old, new):
+    if not old:
+        return 'n/a'
+    return f'{(new - old) / old * 100:+.1f}%'
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    container = prepare_database(args)
+    mock = mock_spotify.MockSpotify(latency=args.latency, jitter=args.jitter, rate_limit=args.rate_limit,
+                                    playlists_per_user=args.playlists_per_user, token_lifetime=args.token_lifetime,
+                                    recommendations=not args.no_recommendations, seed=args.seed)
+    try:
+        app = load_app(mock.start())
+        # As gunicorn.conf.py does in every worker
+        importlib.import_module('main').start_inspiration_feed()
+        mock_spotify.release_years()
+        if args.sweep_playlists_per_user:
+            sweep = sweep_playlists(app, mock, args)
+        else:
+            recorder, elapsed = run(app, args)
+    finally:
+        mock.stop()
+        if container:
+            seed.stop_container(container)
+
+    if args.sweep_playlists_per_user:
+        report_sweep(sweep)
+        if args.save:
+            config = {key: value for key, value in vars(args).items() if key not in ('save', 'compare')}
+            with open(args.save, 'w', encoding='utf-8') as file:
+                json.dump({'config': config, 'sweep': sweep}, file, indent=2)
+        return
+
+    routes = recorder.summary(elapsed)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['routes']
+    report(routes, baseline)
+    print(f"\n{sum(route['requests'] for route in routes.values())} requests in {elapsed:.1f} s, "
+          f"{sum(mock.requests.values())} requests to the mock Spotify server, {mock.rate_limited} of them rate limited")
+
+    if args.save:
+        config = {key: value for key, value in vars(args).items() if key not in ('save', 'compare')}
+        with open(args.save, 'w', encoding='utf-8') as file:
+            json.dump({'config': config, 'elapsed': elapsed, 'routes': routes,
+                       'spotify_requests': mock.requests, 'rate_limited': mock.rate_limited}, file, indent=2)
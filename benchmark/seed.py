@@ -0,0 +1,141 @@
+import os
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta
+import psycopg2
+from psycopg2.extras import execute_values
+import migrate
+from benchmark import mock_spotify
+
+
+def user_id(n):
+    ''' Returns the Spotify ID of seeded user n. '''
+    return f'benchuser{n}'
+
+
+def connect():
+    ''' Connects to the database configured with the same environment variables as db.py. '''
+    return psycopg2.connect(host=os.environ.get("host"), database=os.environ.get("database"),
+                            user=os.environ.get("user"), password=os.environ.get("password"),
+                            port=os.environ.get("port"))
+
+
+def start_container(port=5433, image='postgres:16'):
+    '''
+    Starts a throwaway Postgres container with Docker, waits until it accepts connections,
+    and points the database environment variables at it.
+
+    Returns:
+        - The ID of the container, to be passed to stop_container.
+    '''
+    container = subprocess.run(
+        ['docker', 'run', '-d', '--rm', '-p', f'127.0.0.1:{port}:5432', '-e', 'POSTGRES_PASSWORD=benchmark',
+         '-e', 'POSTGRES_DB=rhythmroulette', image],
+        check=True, capture_output=True, text=True).stdout.strip()
+    os.environ.update(host='127.0.0.1', port=str(port), database='rhythmroulette', user='postgres', password='benchmark')
+
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            connect().close()
+            return container
+        except psycopg2.OperationalError:
+            if time.monotonic() > deadline:
+                stop_container(container)
+                raise
+            time.sleep(0.5)
+
+
+def stop_container(container):
+    subprocess.run(['docker', 'stop', container], check=False, capture_output=True)
+
+
+def create_schema(conn):
+    ''' Creates the tables, or brings them up to date, by applying the migrations. '''
+    migrate.migrate(conn)
+
+
+def insert_playlists(cur, users, playlists_per_user, now):
+    execute_values(cur, "INSERT INTO playlist(pl_id, pl_url, user_id, pl_name, name_checked) VALUES %s",
+                   [(pl_id, f'spotify:playlist:{pl_id}', user_id(n), f'Playlist {pl_id}', now)
+                    for n in range(users) for pl_id in mock_spotify.playlist_ids(user_id(n), playlists_per_user)],
+                   page_size=1000)
+
+
+def seed_playlists(conn, users, playlists_per_user):
+    '''
+    Replaces the playlists of the seeded users, so every user has playlists_per_user of them,
+    and leaves the rest of the seeded data as it is.
+    '''
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM playlist WHERE user_id LIKE 'benchuser%'")
+        insert_playlists(cur, users, playlists_per_user, datetime.now())
+        cur.execute("ANALYZE playlist")
+    conn.commit()
+
+
+def seed(conn, users=10000, friends_per_user=20, comments_per_user=30, playlists_per_user=10,
+         catalog_tracks=20000, genre_tracks=500, seed=0):
+    '''
+    Fills the database with generated users, friendships, comments, playlists and catalog tracks.
+    Existing rows from an earlier seed with the same IDs are replaced.
+
+    Parameters:
+        - users (int): The number of users. They get the IDs benchuser0, benchuser1 and so on.
+        - friends_per_user (int): The average number of friends of every user.
+        - comments_per_user (int): The average number of comments written on every user's profile.
+        - playlists_per_user (int): The number of playlists of every user, matching the mock Spotify server.
+        - catalog_tracks (int): The number of tracks in the track catalog, taken from the mock's catalog.
+        - genre_tracks (int): The number of tracks in the pool of every genre, taken from the mock's catalog.
+        - seed (int): Seeds the random generation, so the same database can be seeded again.
+    '''
+    rng = random.Random(seed)
+    now = datetime.now()
+
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM comment_user WHERE user_one LIKE 'benchuser%' OR user_two LIKE 'benchuser%'")
+        cur.execute("DELETE FROM a_user WHERE s_id LIKE 'benchuser%'")
+
+        execute_values(cur, "INSERT INTO a_user(s_id, display_name, user_bio, r_date) VALUES %s",
+                       [(user_id(n), f'Bench benchuser{n}', f'Bio of user {n}', now - timedelta(days=rng.randrange(1000)))
+                        for n in range(users)], page_size=1000)
+
+        # Each friendship is stored once, with the smaller ID first
+        friendships = set()
+        for _ in range(users * friends_per_user // 2):
+            pair = sorted(rng.sample(range(users), 2))
+            friendships.add((user_id(pair[0]), user_id(pair[1])))
+        execute_values(cur, "INSERT INTO friends_with(user_one, user_two) SELECT LEAST(a, b), GREATEST(a, b) FROM (VALUES %s) AS pairs(a, b)",
+                       list(friendships), page_size=1000)
+
+        execute_values(cur, "INSERT INTO comment_user(user_one, user_two, u_comment, c_date) VALUES %s",
+                       [(user_id(rng.randrange(users)), user_id(rng.randrange(users)), f'Comment {n}', now - timedelta(minutes=n))
+                        for n in range(users * comments_per_user)], page_size=1000)
+
+        insert_playlists(cur, users, playlists_per_user, now)
+
+        catalog = []
+        for n in rng.sample(range(mock_spotify.track_count), min(catalog_tracks, mock_spotify.track_count)):
+            track = mock_spotify.track(n)
+            catalog.append((track['uri'], int(track['album']['release_date'][:4]), track['popularity'],
+                            mock_spotify.audio_features(n)['speechiness']))
+        cur.execute("DELETE FROM track_catalog")
+        execute_values(cur, "INSERT INTO track_catalog(uri, release_year, popularity, speechiness) VALUES %s",
+                       catalog, page_size=1000)
+
+        pools = []
+        for genre_number, genre in enumerate(mock_spotify.genres):
+            numbers = range(genre_number, mock_spotify.track_count, len(mock_spotify.genres))
+            for n in rng.sample(numbers, min(genre_tracks, len(numbers))):
+                features = mock_spotify.audio_features(n)
+                pools.append((genre, features['uri'], mock_spotify.track(n)['popularity'], features['speechiness'],
+                              features['danceability'], features['energy'], features['valence'],
+                              features['acousticness'], features['instrumentalness']))
+        cur.execute("DELETE FROM genre_track")
+        execute_values(cur, """INSERT INTO genre_track(genre, uri, popularity, speechiness, danceability, energy, valence,
+                                                       acousticness, instrumentalness) VALUES %s""",
+                       pools, page_size=1000)
+
+        cur.execute("ANALYZE")
+    conn.commit()
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+load_dotenv()
+
+# If set, the cache is shared between workers through Redis. Otherwise every worker keeps its own cache.
+redis_url = os.environ.get("REDIS_URL")
+# The maximum number of entries kept by the in-process cache before the least recently used is evicted.
+max_entries = int(os.environ.get("cache_max_entries", 1024))
+
+# Seconds each kind of Spotify lookup is cached. Can be overridden with e.g. cache_ttl_playlist=60.
+# Friends are removed from the cache when a friendship changes, but a MemoryCache only forgets them in the
+# worker that made the change, so with several workers friends are only up to date with REDIS_URL set.
+default_ttls = {
+    'genre_seeds': 24 * 60 * 60,
+    'user_profile': 10 * 60,
+    'playlist': 5 * 60,
+    'friends': 10 * 60,
+    'friend_suggestions': 30 * 60,
+}
+ttls = {endpoint: int(os.environ.get(f"cache_ttl_{endpoint}", ttl)) for endpoint, ttl in default_ttls.items()}
+
+_missing = object()
+
+
+class MemoryCache:
+    '''
+    A thread-safe LRU cache kept in the memory of the current process.
+    Entries expire after their TTL and the least recently used entry is evicted
+    when the cache holds more than max_size entries.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _missing
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return _missing
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def touch(self, key, ttl):
+        ''' Makes an entry expire ttl seconds from now instead of when it was going to. '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] >= time.monotonic():
+                self._entries[key] = (entry[0], time.monotonic() + ttl)
+                self._entries.move_to_end(key)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    '''
+    A cache shared by every worker through Redis. Values are stored as JSON and
+    expire after their TTL. Eviction when Redis is full is handled by the
+    server's maxmemory-policy, which should be set to allkeys-lru.
+    '''
+
+    def __init__(self, url, prefix='rr:cache:'):
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        if value is None:
+            return _missing
+        return json.loads(value)
+
+    def set(self, key, value, ttl):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def touch(self, key, ttl):
+        self.client.expire(self.prefix + key, ttl)
+
+
+def create_backend():
+    '''
+    Returns a RedisCache if REDIS_URL is set and the redis package is installed,
+    otherwise a MemoryCache.
+    '''
+    if redis_url and redis is not None:
+        return RedisCache(redis_url)
+    return MemoryCache(max_entries)
+
+
+backend = create_backend()
+_stats = {endpoint: {'hits': 0, 'misses': 0} for endpoint in ttls}
+_stats_lock = threading.Lock()
+
+
+def _count(endpoint, result):
+    with _stats_lock:
+        _stats.setdefault(endpoint, {'hits': 0, 'misses': 0})[result] += 1
+
+
+def cached(endpoint, key, fetch):
+    '''
+    Returns the cached value for key, or calls fetch and caches its result.
+
+    Parameters:
+        - endpoint (str): The kind of lookup, which decides the TTL. One of the keys in ttls.
+        - key (str): What identifies the value within the endpoint, e.g. a playlist ID.
+        - fetch (function): Called without arguments to get the value on a cache miss.
+    '''
+    cache_key = f'{endpoint}:{key}'
+    value = backend.get(cache_key)
+    if value is not _missing:
+        _count(endpoint, 'hits')
+        return value
+
+    _count(endpoint, 'misses')
+    value = fetch()
+    backend.set(cache_key, value, ttls[endpoint])
+    return value
+
+
+def get(endpoint, key):
+    ''' Returns the cached value for key, or None if it isn't cached. Never fetches anything. '''
+    value = backend.get(f'{endpoint}:{key}')
+    _count(endpoint, 'misses' if value is _missing else 'hits')
+    return None if value is _missing else value
+
+
+def put(endpoint, key, value):
+    ''' Caches a value that was computed ahead of time, replacing the one cached before. '''
+    backend.set(f'{endpoint}:{key}', value, ttls[endpoint])
+
+
+def invalidate(endpoint, key):
+    ''' Removes a value from the cache so the next lookup fetches it again. '''
+    backend.delete(f'{endpoint}:{key}')
+
+
+def stats():
+    '''
+    Returns the number of cache hits and misses for each endpoint in this process,
+    and the number of entries if the cache is kept in memory.
+    '''
+    with _stats_lock:
+        result = {'backend': type(backend).__name__,
+                  'endpoints': {endpoint: dict(counts) for endpoint, counts in _stats.items()}}
+    if isinstance(backend, MemoryCache):
+        result['entries'] = len(backend)
+        result['max_entries'] = backend.max_size
+    return result
@@ -0,0 +1,98 @@
+import os
+import threading
+from array import array
+from dotenv import load_dotenv
+import sampling
+from sampling import max_speechiness
+
+load_dotenv()
+
+# Seconds between reloads of the catalog from the database, to pick up tracks added by other workers.
+reload_interval = int(os.environ.get("catalog_reload_interval", 10 * 60))
+
+
+class TrackIndex:
+    '''
+    An in-memory index of tracks stored column by column in compact arrays,
+    so that a scan over the release years of every track stays cheap.
+    '''
+
+    def __init__(self):
+        self.uris = []
+        self.years = array('H')
+        self.popularity = array('B')
+        self.speechiness = array('f')
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def add(self, tracks):
+        '''
+        Adds tracks to the index, or updates them if they are already in it.
+
+        Parameters:
+            - tracks (list): (uri, release_year, popularity, speechiness) tuples.
+        '''
+        with self._lock:
+            for uri, year, popularity, speechiness in tracks:
+                position = self._positions.get(uri)
+                if position is None:
+                    self._positions[uri] = len(self.uris)
+                    self.uris.append(uri)
+                    self.years.append(year)
+                    self.popularity.append(popularity)
+                    self.speechiness.append(speechiness)
+                else:
+                    self.years[position] = year
+                    self.popularity[position] = popularity
+                    self.speechiness[position] = speechiness
+
+    def candidates(self, start_year, end_year):
+        ''' Returns the positions of the playable tracks released between start_year and end_year. '''
+        with self._lock:
+            return [i for i, (year, speechiness) in enumerate(zip(self.years, self.speechiness))
+                    if start_year <= year <= end_year and speechiness < max_speechiness]
+
+    def sample(self, start_year, end_year, count, exclude=()):
+        '''
+        Picks count random tracks released between start_year and end_year.
+        Popular tracks are more likely to be picked, but every track can be.
+
+        Parameters:
+            - start_year (int): The first release year.
+            - end_year (int): The last release year.
+            - count (int): The number of tracks to pick.
+            - exclude (set): URIs that must not be picked.
+        Returns:
+            - A list of at most count track URIs.
+        '''
+        positions = self.candidates(start_year, end_year)
+        with self._lock:
+            weighted = [(self.popularity[i] + 1, self.uris[i]) for i in positions if self.uris[i] not in exclude]
+        return sampling.weighted_sample(weighted, count)
+
+    def __len__(self):
+        return len(self.uris)
+
+
+index = TrackIndex()
+loader = sampling.IndexLoader(index, 'load_track_catalog', 'save_catalog_tracks', reload_interval)
+
+
+def parse_year_range(year_range):
+    ''' Turns a year range like '1990-1999' into the tuple (1990, 1999). '''
+    start_year, end_year = year_range.split('-')
+    return int(start_year), int(end_year)
+
+
+def count(year_range):
+    ''' Returns the number of playable tracks in the index from a year range. '''
+    return len(loader.get().candidates(*parse_year_range(year_range)))
+
+
+def sample(year_range, count, exclude=()):
+    ''' Picks count random tracks from a year range, see TrackIndex.sample. '''
+    return loader.get().sample(*parse_year_range(year_range), count, exclude)
+
+
+# Stores (uri, release_year, popularity, speechiness) tuples in the database and adds them to the index
+add_tracks = loader.add
@@ -1,5 +1,11 @@
 import psycopg2
+from psycopg2 import pool
+from psycopg2.extras import Json
 import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,6 +16,121 @@ user = os.environ.get("user")
 password = os.environ.get("password")
 port = os.environ.get("port")
 
+# Size of the connection pool shared by every thread in the worker process.
+min_connections = int(os.environ.get("db_min_connections", 1))
+max_connections = int(os.environ.get("db_max_connections", 10))
+# Seconds a thread waits for a free connection before giving up.
+checkout_timeout = float(os.environ.get("db_checkout_timeout", 10))
+# Connections idle for longer than this are pinged before they are handed out.
+health_check_interval = float(os.environ.get("db_health_check_interval", 30))
+
+connection_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(max_connections)
+_last_used = {}
+
+
+def init_pool():
+    '''
+    Creates the connection pool if it does not exist yet and returns it.
+    '''
+    global connection_pool
+    with _pool_lock:
+        if connection_pool is None:
+            connection_pool = pool.ThreadedConnectionPool(
+                min_connections,
+                max_connections,
+                host=host,
+                database=database,
+                user=user,
+                password=password,
+                port=port
+            )
+    return connection_pool
+
+
+def _is_healthy(conn):
+    '''
+    Returns False if the connection has been closed or dropped by the server.
+    Connections that were used recently are trusted without a round-trip.
+    '''
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < health_check_interval:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+def _checkout():
+    '''
+    Takes a healthy connection from the pool, replacing any dead connections it finds.
+    '''
+    connections = init_pool()
+    while True:
+        conn = connections.getconn()
+        if _is_healthy(conn):
+            return conn
+        _last_used.pop(id(conn), None)
+        connections.putconn(conn, close=True)
+
+
+@contextmanager
+def get_cursor():
+    '''
+    Checks out a connection from the pool for the duration of one database call
+    and yields a cursor on it. The transaction is committed when the block exits
+    and rolled back if it raises. The connection is always returned to the pool,
+    and dropped connections are discarded so the next checkout reconnects.
+    '''
+    if not _pool_slots.acquire(timeout=checkout_timeout):
+        raise pool.PoolError("Timed out waiting for a free database connection")
+    conn = None
+    try:
+        conn = _checkout()
+        with conn.cursor() as cur:
+            yield cur
+        conn.commit()
+    except Exception:
+        if conn is not None and not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if conn is not None:
+            if conn.closed:
+                _last_used.pop(id(conn), None)
+            else:
+                _last_used[id(conn)] = time.monotonic()
+            connection_pool.putconn(conn, close=bool(conn.closed))
+        _pool_slots.release()
+
+
+@dataclass
+class Profile:
+    '''
+    Everything the profile page shows from the database about one user.
+
+    Attributes:
+        - username (str): The Spotify ID of the user.
+        - register_date (str): When the user registered, formatted as 'YYYY-MM-DD HH24:MI'.
+        - bio (str): The user's biography, or None if they haven't written one.
+        - is_friend (bool): Whether the user viewing the profile is friends with the user.
+        - comments (list): The newest comments written to the user, as dicts in the
+          format returned by get_user_comments.
+        - more_comments (bool): Whether there are older comments than those in comments.
+    '''
+    username: str
+    register_date: str
+    bio: str = None
+    is_friend: bool = False
+    comments: list = field(default_factory=list)
+    more_comments: bool = False
+
 
 def check_user_in_db(user_id):
     '''
@@ -18,82 +139,154 @@ def check_user_in_db(user_id):
     Parameters: 
         - user_id (str): The spotify ID provided from spotipy through authorization.
     '''
-    cur.execute(
-                '''
-                SELECT s_id FROM a_user
-                WHERE s_id = %s
-                ''', (user_id,)        
-        )
-    existing_user = cur.fetchall()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    SELECT s_id FROM a_user
+                    WHERE s_id = %s
+                    ''', (user_id,)        
+            )
+        existing_user = cur.fetchall()
     if len(existing_user) == 0:
         return False
     else:
         return existing_user
 
 
-def search_users(search_value):
+def search_users(search_value, limit=20, offset=0):
     '''
-    Compares the search_value recieved from main.py with the s_id columns in the a_user table
-    to search for users.
+    Searches for users whose s_id or display name contains the search_value.
+    The best matches come first: exact matches, then by trigram similarity.
+    The ILIKE filters are served by the pg_trgm GIN indexes on a_user.
+
     Parameters: 
         - search_value (str): what the user searches for in the application. 
+        - limit (int): The maximum number of users to return.
+        - offset (int): The number of matching users to skip.
+    Returns:
+        - A list of (s_id, display_name) rows.
     '''
-    cur.execute(
-                '''
-                SELECT s_id FROM a_user
-                WHERE s_id LIKE %s
-                ''', ('%' + search_value + '%',) 
-    )
-    return cur.fetchall()
+    pattern = '%' + escape_like(search_value) + '%'
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    SELECT s_id, display_name FROM a_user
+                    WHERE s_id ILIKE %(pattern)s OR display_name ILIKE %(pattern)s
+                    ORDER BY lower(s_id) = lower(%(term)s) DESC,
+                             GREATEST(similarity(s_id, %(term)s), similarity(COALESCE(display_name, ''), %(term)s)) DESC,
+                             s_id
+                    LIMIT %(limit)s OFFSET %(offset)s
+                    ''', {'pattern': pattern, 'term': search_value, 'limit': limit, 'offset': offset}
+        )
+        return cur.fetchall()
+
+
+def escape_like(value):
+    ''' Escapes the characters that have a special meaning in a LIKE pattern. '''
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
 
 
 def become_friends(user_1, user_2):
-    cur.execute(
-        '''
-        INSERT INTO friends_with
-        VALUES (%s, %s)
-        ''', (user_1, user_2)
-    )
-    conn.commit()
+    '''
+    Stores a friendship. Every friendship is stored once, with the smallest ID in user_one,
+    so it can be looked up with the primary key no matter who is asking.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+            '''
+            INSERT INTO friends_with
+            VALUES (LEAST(%(user_1)s, %(user_2)s), GREATEST(%(user_1)s, %(user_2)s))
+            ON CONFLICT DO NOTHING
+            ''', {'user_1': user_1, 'user_2': user_2}
+        )
 
 def check_if_friends(user_1, user_2):
-    cur.execute(
-        '''
-        SELECT * FROM friends_with
-        WHERE user_one = %s AND user_two = %s OR user_one = %s AND user_two = %s
-        ''', (user_1, user_2, user_2, user_1)
-    )
-    friends_with = cur.fetchall()
-    if len(friends_with) > 0:
-        return True
-    else: 
-        return False
+    with get_cursor() as cur:
+        cur.execute(
+            '''
+            SELECT 1 FROM friends_with
+            WHERE user_one = LEAST(%(user_1)s, %(user_2)s) AND user_two = GREATEST(%(user_1)s, %(user_2)s)
+            ''', {'user_1': user_1, 'user_2': user_2}
+        )
+        return cur.fetchone() is not None
 
 
 def remove_friend(user_1, user_2):
-    cur.execute(
-        '''
-        DELETE FROM friends_with 
-        WHERE user_one = %s AND user_two = %s OR user_one = %s AND user_two = %s
-        ''', (user_1, user_2, user_2, user_1)
-    )
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+            '''
+            DELETE FROM friends_with 
+            WHERE user_one = LEAST(%(user_1)s, %(user_2)s) AND user_two = GREATEST(%(user_1)s, %(user_2)s)
+            ''', {'user_1': user_1, 'user_2': user_2}
+        )
 
 
-def register_user(user_id):
+def list_friends(user_id):
     '''
-    Registers a user to the database.
+    Returns the Spotify IDs of a user's friends, sorted.
+    The two halves are served by the primary key and the index on user_two.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+            '''
+            SELECT user_two FROM friends_with WHERE user_one = %(user)s
+            UNION ALL
+            SELECT user_one FROM friends_with WHERE user_two = %(user)s
+            ORDER BY 1
+            ''', {'user': user_id}
+        )
+        return [friend for friend, in cur.fetchall()]
+
+
+def friend_suggestions(user_id, limit):
+    '''
+    Suggests friends of the user's friends who aren't already their friends,
+    ranked by how many friends they have in common with the user.
+
+    Parameters:
+        - user_id (str): The Spotify ID of the user.
+        - limit (int): The maximum number of suggestions.
+    Returns:
+        - A list of (s_id, mutual_friends) rows.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+            '''
+            WITH friends AS (
+                SELECT user_two AS friend FROM friends_with WHERE user_one = %(user)s
+                UNION ALL
+                SELECT user_one FROM friends_with WHERE user_two = %(user)s
+            ), friends_of_friends AS (
+                SELECT fw.user_two AS candidate FROM friends_with fw JOIN friends f ON fw.user_one = f.friend
+                UNION ALL
+                SELECT fw.user_one FROM friends_with fw JOIN friends f ON fw.user_two = f.friend
+            )
+            SELECT candidate, COUNT(*) AS mutual_friends FROM friends_of_friends
+            WHERE candidate <> %(user)s AND candidate NOT IN (SELECT friend FROM friends)
+            GROUP BY candidate
+            ORDER BY mutual_friends DESC, candidate
+            LIMIT %(limit)s
+            ''', {'user': user_id, 'limit': limit}
+        )
+        return cur.fetchall()
+
+
+def register_user(user_id, display_name=None):
+    '''
+    Registers a user to the database, or updates the display name of a registered user.
 
     Parameters:
         - user_id (str): the Spotify-id from the current user.
+        - display_name (str): the Spotify display name of the current user.
     '''
-    cur.execute(
-                '''
-                INSERT INTO a_user
-                VALUES (%s)
-                ''', (user_id,)      
-    )
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    INSERT INTO a_user(s_id, display_name)
+                    VALUES (%s, %s)
+                    ON CONFLICT (s_id) DO UPDATE SET display_name = EXCLUDED.display_name
+                    ''', (user_id, display_name)      
+        )
 
 
 def delete_user(user_id):
@@ -103,62 +296,63 @@ def delete_user(user_id):
     Parameters: 
         - user_id (str): The Spotify-id from the current user.
     '''
-    cur.execute(
-                '''
-                DELETE FROM a_user
-                WHERE s_id = %s
-                ''', (user_id,)
-    )
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    DELETE FROM a_user
+                    WHERE s_id = %s
+                    ''', (user_id,)
+        )
 
 
-def add_playlist(pl_id,pl_url,user_id):
+def add_playlist(pl_id,pl_url,user_id,pl_name=None):
     '''
     Saves the playlist to the database
     Parameters:
         - pl_id: The ID of the Spotify playlist created through the application.
         - pl_url: The uri of the playlist created through the application.
         - user_id: The Spotify ID of the user created the playlist.
+        - pl_name: The name of the playlist, stored so it doesn't have to be fetched from Spotify.
     '''
-
-    cur.execute(
-                '''
-                INSERT INTO playlist(pl_id, pl_url, user_id)
-                VALUES (%s, %s, %s)
-                ''',(pl_id, pl_url, user_id)
-    )
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    INSERT INTO playlist(pl_id, pl_url, user_id, pl_name, name_checked)
+                    VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP)
+                    ''',(pl_id, pl_url, user_id, pl_name)
+        )
 
 def generated_playlist_info(playlist_id, playlist_name, nr_songs, created_date):
     '''
-    Inserting information about a playlist generated
+    Saves information about a generated playlist. If the playlist has been generated
+    before, its name and date are updated and nr_songs is added to its length.
         Parameters: 
-        - pl_id (str): The playlist-id from the current playlist.
-    Returns:
-        - pl_name (str): The name of the playlist.
-        - nr_songs (int): The number of songs in the playlist.
-        - date_created (date): The date when the playlist was created.
+        - playlist_id (str): The playlist-id from the current playlist.
+        - playlist_name (str): The name of the playlist.
+        - nr_songs (int): The number of songs added to the playlist.
+        - created_date (date): The date when the playlist was generated.
 	'''
-
-    cur.execute(
-				'''
-				INSERT INTO about_generated_playlist(pl_id, playlist_name, playlist_length, last_updated_datetime)
-				VALUES (%s, %s, %s, %s)
-				''', (playlist_id, playlist_name, nr_songs, created_date)
-    )
-
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    INSERT INTO about_generated_playlist(pl_id, playlist_name, playlist_length, last_updated_datetime)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (pl_id) DO UPDATE
+                    SET playlist_name = EXCLUDED.playlist_name,
+                        playlist_length = about_generated_playlist.playlist_length + EXCLUDED.playlist_length,
+                        last_updated_datetime = EXCLUDED.last_updated_datetime
+                    ''', (playlist_id, playlist_name, nr_songs, created_date)
+        )
 
 def check_if_playlist_is_own(pl_id):
-    
-    cur.execute(
-                '''
-                SELECT user_id FROM playlist 
-                WHERE pl_id = %s
-                ''',(pl_id,)
-    )
-
-    return cur.fetchone()[0]
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    SELECT user_id FROM playlist 
+                    WHERE pl_id = %s
+                    ''',(pl_id,)
+        )
+        return cur.fetchone()[0]
 
 def check_playlist(user_id):
     '''
@@ -166,16 +360,46 @@ def check_playlist(user_id):
 
     Parameters: 
         - user_id: The ID of the current user
+    Returns:
+        - A list of (pl_id, pl_name, name_age) rows. pl_name is None if the
+          name has not been fetched from Spotify yet. name_age is the time since the
+          name was checked against Spotify as a timedelta, or None if it never was.
+          It is computed by the database, with the same clock that set name_checked,
+          so the app's clock and time zone don't matter.
     '''
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    SELECT pl_id, pl_name, now() - name_checked FROM playlist 
+                    WHERE user_id = %s
+                    ''',(user_id,)
+        )
+        return cur.fetchall()
 
-    cur.execute(
-                '''
-                SELECT pl_id FROM playlist 
-                WHERE user_id = %s
-                ''',(user_id,)
-    )
 
-    return cur.fetchall()
+def sync_playlist_names(user_id, spotify_playlists):
+    '''
+    Updates the stored names of a user's playlists and removes the playlists
+    that are no longer on the user's Spotify account.
+
+    Parameters:
+        - user_id: The ID of the user owning the playlists.
+        - spotify_playlists (dict): Playlist IDs mapped to names, as found on Spotify.
+    '''
+    with get_cursor() as cur:
+        cur.executemany(
+                    '''
+                    UPDATE playlist
+                    SET pl_name = %s, name_checked = CURRENT_TIMESTAMP
+                    WHERE pl_id = %s AND user_id = %s
+                    ''', [(pl_name, pl_id, user_id) for pl_id, pl_name in spotify_playlists.items()]
+        )
+        cur.execute(
+                    '''
+                    DELETE FROM playlist
+                    WHERE user_id = %s AND NOT pl_id = ANY(%s)
+                    ''', (user_id, list(spotify_playlists))
+        )
 
 
 def delete_playlist(pl_id):
@@ -185,97 +409,277 @@ def delete_playlist(pl_id):
     Parameters:
         - pl_id(str): The provided playlist ID.
     '''
-    cur.execute(
-                ''' 
-                DELETE FROM playlist
-                WHERE pl_id = %s 
-                ''', (pl_id,)
-    )
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    ''' 
+                    DELETE FROM playlist
+                    WHERE pl_id = %s 
+                    ''', (pl_id,)
+        )
 
 
 def save_user_bio(user_id, bio_text):
     ''' Adds a user biopraph of maximum 500 words into the database or update if one already exist'''
     user_id = str(user_id)
     bio_text = str(bio_text)
-    cur.execute(
-                '''
-                INSERT INTO a_user(s_id, user_bio)
-                VALUES  (%s, %s) 
-                ON CONFLICT (s_id) DO UPDATE SET user_bio = EXCLUDED.user_bio
-                ''', (user_id, bio_text)
-    ) 
-    conn.commit()
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    INSERT INTO a_user(s_id, user_bio)
+                    VALUES  (%s, %s) 
+                    ON CONFLICT (s_id) DO UPDATE SET user_bio = EXCLUDED.user_bio
+                    ''', (user_id, bio_text)
+        ) 
 
 def get_user_bio(user_id):
-    cur.execute(
-                '''
-                SELECT user_bio FROM a_user
-                WHERE s_id = %s
-                ''', (user_id, )
-    )
-    return cur.fetchone()[0]
+    with get_cursor() as cur:
+        cur.execute(
+                    '''
+                    SELECT user_bio FROM a_user
+                    WHERE s_id = %s
+                    ''', (user_id, )
+        )
+        return cur.fetchone()[0]
 
 
 def get_user_r_date(user_id):
-    cur.execute(
-            '''
-            SELECT TO_CHAR(r_date, 'YYYY-MM-DD HH24:MI') as formatted_date
-            FROM a_user
-            WHERE s_id = %s;
-            ''', (user_id, )
-    )
-    registered = cur.fetchone()[0]
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                SELECT TO_CHAR(r_date, 'YYYY-MM-DD HH24:MI') as formatted_date
+                FROM a_user
+                WHERE s_id = %s;
+                ''', (user_id, )
+        )
+        registered = cur.fetchone()[0]
     if len(registered) == 0:
         return False
     return registered
 
-def comment_user(user_1, user_2, comment_text):
-    cur.execute(
-            '''
-            INSERT INTO comment_user (user_one, user_two, u_comment)
-            VALUES(%s, %s, %s)
-            ''', (user_1, user_2, comment_text )
-    )
-    conn.commit()
-
-def get_user_comments(user_id):
-            cur.execute(
+def load_profile(user_id, viewer_id, comment_limit):
+    '''
+    Loads a user's profile, their friendship with the viewer and their newest comments
+    in a single query.
+
+    Parameters:
+        - user_id (str): The Spotify ID of the user whose profile is shown.
+        - viewer_id (str): The Spotify ID of the user looking at the profile.
+        - comment_limit (int): The maximum number of comments to load.
+    Returns:
+        - A Profile, or None if the user isn't registered.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
                 '''
-                SELECT user_one, user_two, u_comment, TO_CHAR(c_date, 'YYYY-MM-DD HH24:MI') as formatted_date
-                FROM comment_user
-                WHERE user_two = %s
-                ''', (user_id,)
-    )
-            return cur.fetchall()
+                SELECT u.s_id,
+                       TO_CHAR(u.r_date, 'YYYY-MM-DD HH24:MI'),
+                       u.user_bio,
+                       EXISTS (
+                           SELECT 1 FROM friends_with
+                           WHERE user_one = LEAST(u.s_id, %(viewer)s) AND user_two = GREATEST(u.s_id, %(viewer)s)
+                       ),
+                       (
+                           SELECT COALESCE(json_agg(json_build_object(
+                                      'c_id', c.c_id, 'user_one', c.user_one, 'user_two', c.user_two,
+                                      'u_comment', c.u_comment, 'c_date', c.c_date,
+                                      'formatted_date', TO_CHAR(c.c_date, 'YYYY-MM-DD HH24:MI')
+                                  ) ORDER BY c.c_date DESC, c.c_id DESC), '[]')
+                           FROM (
+                               SELECT c_id, user_one, user_two, u_comment, c_date FROM comment_user
+                               WHERE user_two = u.s_id
+                               ORDER BY c_date DESC, c_id DESC
+                               LIMIT %(limit)s
+                           ) c
+                       )
+                FROM a_user u
+                WHERE u.s_id = %(user)s
+                ''', {'user': user_id, 'viewer': viewer_id, 'limit': comment_limit + 1}
+        )
+        row = cur.fetchone()
+    if row is None:
+        return None
 
+    username, register_date, bio, is_friend, comments = row
+    return Profile(username, register_date, bio, is_friend, comments[:comment_limit], len(comments) > comment_limit)
 
-def remove_comment(user_1, user_2, comment_text):
-    cur.execute(
-            '''
-            DELETE FROM comment_user
-            WHERE user_one = %s AND user_two = %s AND u_comment = %s
-            ''', (user_1, user_2, comment_text )
-    )
-    conn.commit()
+def get_top_items_snapshot(user_id, item_type, time_range):
+    '''
+    Returns the latest stored snapshot of a user's top artists or tracks.
 
+    Parameters:
+        - user_id (str): The Spotify ID of the user.
+        - item_type (str): 'artists' or 'tracks'.
+        - time_range (str): 'short_term', 'medium_term' or 'long_term'.
+    Returns:
+        - An (age, items) tuple, or None if there is no snapshot. age is the time since the
+          snapshot was taken, as a timedelta.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                SELECT now() - taken_at, items FROM top_items_snapshot
+                WHERE user_id = %s AND item_type = %s AND time_range = %s
+                ORDER BY taken_at DESC
+                LIMIT 1
+                ''', (user_id, item_type, time_range)
+        )
+        return cur.fetchone()
 
 
+def save_top_items_snapshot(user_id, item_type, time_range, items):
+    '''
+    Stores a new snapshot of a user's top artists or tracks. Older snapshots are kept
+    so the history can be shown later.
 
+    Parameters:
+        - user_id (str): The Spotify ID of the user.
+        - item_type (str): 'artists' or 'tracks'.
+        - time_range (str): 'short_term', 'medium_term' or 'long_term'.
+        - items (list): The top items, in order.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                INSERT INTO top_items_snapshot(user_id, item_type, time_range, items)
+                VALUES (%s, %s, %s, %s)
+                ''', (user_id, item_type, time_range, Json(items))
+        )
 
+def load_track_catalog():
+    '''
+    Returns every track in the track catalog as (uri, release_year, popularity, speechiness) rows.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                SELECT uri, release_year, popularity, speechiness FROM track_catalog
+                '''
+        )
+        return cur.fetchall()
 
 
+def save_catalog_tracks(tracks):
+    '''
+    Adds tracks to the track catalog, or updates them if they are already in it.
+
+    Parameters:
+        - tracks (list): (uri, release_year, popularity, speechiness) tuples.
+    '''
+    with get_cursor() as cur:
+        cur.executemany(
+                '''
+                INSERT INTO track_catalog(uri, release_year, popularity, speechiness)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (uri) DO UPDATE
+                SET release_year = EXCLUDED.release_year,
+                    popularity = EXCLUDED.popularity,
+                    speechiness = EXCLUDED.speechiness
+                ''', tracks
+        )
+
+def load_genre_tracks():
+    '''
+    Returns every track in the genre pools as (genre, uri, popularity, speechiness, danceability,
+    energy, valence, acousticness, instrumentalness) rows.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                SELECT genre, uri, popularity, speechiness, danceability, energy, valence, acousticness, instrumentalness
+                FROM genre_track
+                '''
+        )
+        return cur.fetchall()
+
+
+def save_genre_tracks(tracks):
+    '''
+    Adds tracks to the genre pools, or updates them if they are already in them.
+
+    Parameters:
+        - tracks (list): (genre, uri, popularity, speechiness, danceability, energy, valence,
+          acousticness, instrumentalness) tuples.
+    '''
+    with get_cursor() as cur:
+        cur.executemany(
+                '''
+                INSERT INTO genre_track(genre, uri, popularity, speechiness, danceability, energy, valence, acousticness, instrumentalness)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (genre, uri) DO UPDATE
+                SET popularity = EXCLUDED.popularity,
+                    speechiness = EXCLUDED.speechiness,
+                    danceability = EXCLUDED.danceability,
+                    energy = EXCLUDED.energy,
+                    valence = EXCLUDED.valence,
+                    acousticness = EXCLUDED.acousticness,
+                    instrumentalness = EXCLUDED.instrumentalness
+                ''', tracks
+        )
+
+def comment_user(user_1, user_2, comment_text):
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                INSERT INTO comment_user (user_one, user_two, u_comment)
+                VALUES(%s, %s, %s)
+                ''', (user_1, user_2, comment_text )
+        )
+
+def get_user_comments(user_id, limit, before=None):
+    '''
+    Returns a page of the comments written to a user, newest first. The page is found
+    with the (user_two, c_date, c_id) index, so it is as fast for old comments as new ones.
+
+    Parameters:
+        - user_id (str): The Spotify ID of the user the comments are written to.
+        - limit (int): The maximum number of comments to return.
+        - before (tuple): The c_date and c_id of the last comment on the previous page,
+          or None for the first page.
+    Returns:
+        - A list of dicts with the keys c_id, user_one, user_two, u_comment,
+          c_date (ISO format) and formatted_date.
+    '''
+    before_date, before_id = before if before else (None, None)
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                SELECT c_id, user_one, user_two, u_comment, c_date, TO_CHAR(c_date, 'YYYY-MM-DD HH24:MI') as formatted_date
+                FROM comment_user
+                WHERE user_two = %(user)s
+                  AND (%(before_date)s::timestamp IS NULL OR (c_date, c_id) < (%(before_date)s::timestamp, %(before_id)s))
+                ORDER BY c_date DESC, c_id DESC
+                LIMIT %(limit)s
+                ''', {'user': user_id, 'before_date': before_date, 'before_id': before_id, 'limit': limit}
+        )
+        rows = cur.fetchall()
+    return [{'c_id': c_id, 'user_one': user_one, 'user_two': user_two, 'u_comment': u_comment,
+             'c_date': c_date.isoformat(), 'formatted_date': formatted_date}
+            for c_id, user_one, user_two, u_comment, c_date, formatted_date in rows]
+
+
+def remove_comment(c_id, user_id):
+    '''
+    Deletes a comment if it was written by or to the user.
+
+    Parameters:
+        - c_id (int): The ID of the comment.
+        - user_id (str): The Spotify ID of the user deleting the comment.
+    Returns:
+        - The Spotify ID of the user the comment was written to, or None if nothing was deleted.
+    '''
+    with get_cursor() as cur:
+        cur.execute(
+                '''
+                DELETE FROM comment_user
+                WHERE c_id = %s AND (user_one = %s OR user_two = %s)
+                RETURNING user_two
+                ''', (c_id, user_id, user_id)
+        )
+        deleted = cur.fetchone()
+    return deleted[0] if deleted else None
 
 try: 
-    conn = psycopg2.connect(
-    host=host,
-    database=database,
-    user=user,
-    password=password,
-    port=port  
-    )
-
-    cur = conn.cursor()
-    
+    init_pool()
+
 except psycopg2.Error as error: 
-    print(f"Error: unable to connect to the database\n {error}")
\ No newline at end of file
+    print(f"Error: unable to connect to the database\n {error}")
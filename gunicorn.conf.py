@@ -0,0 +1,18 @@
+# Read by gunicorn from the working folder, so the Procfile's "gunicorn main:app" uses it.
+
+
+def on_starting(server):
+    '''
+    Refuses to start more than one worker when the sessions are kept in memory, since every worker
+    would then have its own sessions and users would be logged out whenever another worker answered.
+    '''
+    import sessions
+    if server.cfg.workers > 1 and not sessions.is_shared():
+        raise RuntimeError(f"{server.cfg.workers} workers need REDIS_URL to share the sessions, "
+                           "set it or run a single worker")
+
+
+def post_worker_init(worker):
+    ''' Starts the inspiration feed in every worker once it has loaded the app. '''
+    import main
+    main.start_inspiration_feed()
@@ -0,0 +1,86 @@
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import cache
+
+load_dotenv()
+
+# If set, job statuses are shared between workers through Redis so any worker can answer a status request.
+redis_url = os.environ.get("REDIS_URL")
+# The number of playlists that can be generated at the same time in each worker process.
+max_workers = int(os.environ.get("generation_workers", 4))
+# Seconds a job's status is kept after it was last updated.
+job_ttl = int(os.environ.get("job_ttl", 60 * 60))
+# The maximum number of job statuses kept in memory before the least recently used is evicted
+max_jobs = int(os.environ.get("job_max_entries", 10000))
+
+
+def create_store():
+    '''
+    Returns a RedisCache for the job statuses if REDIS_URL is set and the redis package is installed,
+    otherwise a MemoryCache.
+    '''
+    if redis_url and cache.redis is not None:
+        return cache.RedisCache(redis_url, prefix='rr:job:')
+    return cache.MemoryCache(max_jobs)
+
+
+store = create_store()
+executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='generation')
+
+
+def _save(job_id, job):
+    # A copy, since the MemoryCache keeps the dict itself and the job keeps changing it
+    store.set(job_id, dict(job), job_ttl)
+
+
+def submit(user_id, function, *args):
+    '''
+    Runs a function in the background worker pool and returns the ID of the job.
+    The function is called with a progress function as its first argument, which it
+    can call with the number of steps done and the total number of steps.
+
+    Parameters:
+        - user_id (str): The Spotify ID of the user who started the job. Only they can see its status.
+        - function (function): The work to do. Its return value becomes the job's message.
+        - args: The arguments passed to the function after the progress function.
+    '''
+    job_id = uuid.uuid4().hex
+    _save(job_id, {'user_id': user_id, 'status': 'queued', 'done': 0, 'total': 0, 'message': None})
+    executor.submit(_run, job_id, user_id, function, args)
+    return job_id
+
+
+def _run(job_id, user_id, function, args):
+    job = {'user_id': user_id, 'status': 'running', 'done': 0, 'total': 0, 'message': None}
+    _save(job_id, job)
+
+    def progress(done, total):
+        job['done'] = done
+        job['total'] = total
+        _save(job_id, job)
+
+    try:
+        job['message'] = function(progress, *args)
+        job['status'] = 'done'
+    except Exception:
+        logging.getLogger(__name__).exception(f"Job {job_id} failed")
+        job['status'] = 'failed'
+    _save(job_id, job)
+
+
+def get(job_id, user_id):
+    '''
+    Returns the status of a job, or None if it doesn't exist or belongs to another user.
+
+    Returns:
+        - A dict with the keys status ('queued', 'running', 'done' or 'failed'),
+          done, total and message.
+    '''
+    job = store.get(job_id)
+    # The store returns something else than a dict when the ID is unknown
+    if not isinstance(job, dict) or job['user_id'] != user_id:
+        return None
+    return {key: value for key, value in job.items() if key != 'user_id'}
@@ -1,30 +1,95 @@
-from flask import Flask, render_template, url_for, session, redirect, request, flash, jsonify
-from spotipy import Spotify
-from spotipy.oauth2 import SpotifyOAuth, SpotifyOauthError 
-from spotipy.cache_handler import FlaskSessionCacheHandler
+from flask import Flask, render_template, url_for, session, redirect, request, flash, jsonify, copy_current_request_context, g, Response
+from werkzeug.local import LocalProxy
+from spotipy import Spotify, SpotifyException
+import requests
+from requests.adapters import HTTPAdapter
+from spotipy.oauth2 import SpotifyOAuth, SpotifyOauthError, SpotifyClientCredentials
+from spotipy.cache_handler import FlaskSessionCacheHandler, MemoryCacheHandler
+from spotipy.util import Retry
 import os
 from dotenv import load_dotenv
 import db
+import cache
+import jobs
+import metrics
+import catalog
+import recommender
+import sessions
 import random
+import threading
+import time
 import datetime
-from datetime import datetime
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 
 load_dotenv()
 client_id = os.environ.get("client_id")
 client_secret = os.environ.get("client_secret")
 redirect_uri = os.environ.get("redirect_uri")
+# Where Spotify's Web API and accounts service are. Only changed to run against the mock server in benchmark/.
+spotify_api_url = os.environ.get("spotify_api_url", "https://api.spotify.com/v1/")
+spotify_accounts_url = os.environ.get("spotify_accounts_url", "https://accounts.spotify.com/")
+# How long a stored playlist name is trusted before it is checked against Spotify again
+playlist_refresh_interval = timedelta(hours=float(os.environ.get("playlist_refresh_hours", 24)))
+# The access token is refreshed when it has less than this many seconds left
+token_refresh_window = int(os.environ.get("token_refresh_window", 60))
+# Spotify accepts at most 100 track IDs in one audio-features request
+audio_features_batch_size = 100
+# Spotify adds at most 100 tracks to a playlist per request
+playlist_write_chunk_size = 100
+# How many times a chunk of tracks is retried when Spotify is rate limiting or failing
+playlist_write_retries = 5
+# A year range or genre is searched on Spotify when the track catalog or its genre pool has fewer than
+# this many tracks per track wanted from it
+catalog_pool_factor = 3
+# The number of tracks fetched from Spotify each time a year range or genre is searched, and the maximum Spotify allows
+catalog_fill_size = 50
+# Spotify search only returns the first 1000 results of a query
+spotify_search_max_offset = 1000
+# The number of tracks shown on the first screen of a playlist page. Spotify returns at most 100 per request.
+playlist_page_size = 50
+max_playlist_page_size = 100
+# How often the stored top artists and tracks are refreshed from Spotify
+top_items_refresh_interval = timedelta(hours=float(os.environ.get("top_items_refresh_hours", 24)))
+# Spotify returns at most 50 top items per request. They are shown 20 per page.
+top_items_limit = 50
+top_items_page_size = 20
+top_items_time_ranges = {'short_term': 'Senaste månaden', 'medium_term': 'Senaste 6 månaderna', 'long_term': 'Senaste året'}
+# The number of comments shown on a profile page
+profile_comments_page_size = 20
+# The number of friend suggestions shown on the user's own profile page
+friend_suggestions_limit = 5
+# The number of users shown on each page of user search results
+user_search_page_size = 20
+# How often the inspiration feed on the home page is rebuilt. 0 turns the feed off.
+inspiration_refresh_interval = float(os.environ.get("inspiration_refresh_minutes", 30)) * 60
+# The number of picks in the inspiration feed, each with inspiration_track_count tracks from one genre
+inspiration_pool_size = int(os.environ.get("inspiration_pool_size", 20))
+inspiration_track_count = 5
+# The feed is cached for two refresh intervals, so it is still there when the next rebuild is due even if that rebuild fails
+cache.ttls['inspiration'] = int(os.environ.get("cache_ttl_inspiration", 2 * inspiration_refresh_interval))
+# Spotify returns at most 50 tracks per request for several tracks
+tracks_batch_size = 50
+# Only the track fields shown on the playlist page are requested from Spotify
+playlist_track_fields = 'items(track(name,artists(name),album(name,images))),total'
 
 
 # This variable is used to run the program
 app = Flask(__name__) 
 # Secret key is needed when you use sessions in Flask
 app.config['SECRET_KEY'] = os.environ.get("FLASK_SECRET_KEY")
+# The session data is kept on the server, and the session cookie only holds the session's ID
+app.session_interface = sessions.ServerSideSessionInterface()
 # The scope defines which information from the Spotify account we get access to
 scope = 'user-top-read playlist-modify-public playlist-modify-private'
 # cache_handler allows us to store the Spotify Token in Flask session
 cache_handler = FlaskSessionCacheHandler(session) 
 # This variable is used for connection to the database.
 db = db 
+# Records the time spent in every route, db.py function, Spotify endpoint and template.
+# Set metrics_timing_header=1 to also send each request's breakdown in a Server-Timing header.
+metrics.init_app(app, timing_header=os.environ.get("metrics_timing_header") == "1")
+metrics.instrument_module(db, 'db', exclude=('init_pool', 'get_cursor', 'escape_like'))
 ''' 
 sp_oauth is used to authorize the Spotify user. They get prompted to accept or decline
 the terms of service defined in our scope. 
@@ -37,14 +102,188 @@ sp_oauth = SpotifyOAuth (
     scope=scope,
     show_dialog = True
 )
-# This variable lets us connect to the authorized Spotify user
-sp = Spotify(auth_manager=sp_oauth) 
+sp_oauth.OAUTH_AUTHORIZE_URL = spotify_accounts_url + 'authorize'
+sp_oauth.OAUTH_TOKEN_URL = spotify_accounts_url + 'api/token'
+# Connections to Spotify are kept alive and shared by every thread, up to spotify_pool_size at a time
+spotify_pool_size = int(os.environ.get("spotify_pool_size", 20))
+# Requests that are rate limited or fail with a server error are retried like spotipy does with its own
+# sessions, after the Retry-After time Spotify asks for
+spotify_retry = Retry(
+    total=Spotify.max_retries,
+    connect=None,
+    read=False,
+    allowed_methods=frozenset(['GET', 'POST', 'PUT', 'DELETE']),
+    status=Spotify.max_retries,
+    backoff_factor=0.3,
+    status_forcelist=Spotify.default_retry_codes
+)
+spotify_session = requests.Session()
+spotify_session.mount(spotify_api_url, HTTPAdapter(pool_connections=1, pool_maxsize=spotify_pool_size, max_retries=spotify_retry))
+# Playlist writes are not retried by the adapter, since add_tracks_to_playlist retries them itself
+spotify_write_session = requests.Session()
+spotify_write_session.mount(spotify_api_url, HTTPAdapter(pool_connections=1, pool_maxsize=spotify_pool_size, max_retries=0))
+
+
+class InstrumentedSpotify(Spotify):
+    ''' A Spotify client that records how long every request to each endpoint takes. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prefix = spotify_api_url
+
+    def __del__(self):
+        # spotipy closes the client's session when the client is garbage collected, but the
+        # shared sessions outlive the per-request clients and must keep their connections open
+        if getattr(self, '_session', None) not in (spotify_session, spotify_write_session):
+            super().__del__()
+
+    def _internal_call(self, method, url, payload, params):
+        with metrics.timed('spotify', f'{method} {spotify_endpoint(url)}'):
+            return super()._internal_call(method, url, payload, params)
+
+
+def spotify_endpoint(url):
+    '''
+    Returns the path of a Spotify API URL with the IDs replaced by {id},
+    e.g. 'playlists/{id}/tracks', so calls to the same endpoint are counted together.
+    '''
+    path = url.removeprefix(spotify_api_url).split('?')[0].strip('/')
+    segments = path.split('/')
+    for i in range(1, len(segments)):
+        if segments[i - 1] in ('playlists', 'users', 'artists', 'albums', 'tracks', 'audio-features'):
+            segments[i] = '{id}'
+    return '/'.join(segments)
+
+
+class SessionTokenAuth:
+    '''
+    Gives a Spotify client the access token in the user's session. A token that expires within
+    token_refresh_window seconds is refreshed with refresh_token first, so a background job
+    that outlives the token it started with keeps working.
+    '''
+
+    def get_access_token(self, as_dict=False):
+        token_info = cache_handler.get_cached_token()
+        if token_info['expires_at'] - int(time.time()) < token_refresh_window:
+            token_info = refresh_token(token_info['refresh_token'])
+        return token_info if as_dict else token_info['access_token']
+
+
+session_token_auth = SessionTokenAuth()
+
+
+def get_spotify():
+    '''
+    Returns the Spotify client of the current request. Every request gets its own client,
+    authorized with the access token in the user's session, while the connections to
+    Spotify are shared through spotify_session.
+    '''
+    if 'spotify' not in g:
+        token_info = cache_handler.get_cached_token()
+        if token_info:
+            g.spotify = InstrumentedSpotify(auth_manager=session_token_auth, requests_session=spotify_session)
+        else:
+            g.spotify = InstrumentedSpotify(auth_manager=sp_oauth, requests_session=spotify_session)
+    return g.spotify
+
+
+def get_playlist_writer():
+    '''
+    Returns a Spotify client of the current request that doesn't retry failed requests,
+    used by add_tracks_to_playlist, which retries every chunk itself.
+    '''
+    if 'playlist_writer' not in g:
+        g.playlist_writer = InstrumentedSpotify(auth_manager=session_token_auth, requests_session=spotify_write_session)
+    return g.playlist_writer
+
+
+# Used for work done outside of the users' requests, authorized as the app itself instead of a user
+# The app's token is kept in memory, not in a .cache file in the working folder
+app_oauth = SpotifyClientCredentials(client_id=client_id, client_secret=client_secret, cache_handler=MemoryCacheHandler())
+app_oauth.OAUTH_TOKEN_URL = spotify_accounts_url + 'api/token'
+app_spotify = InstrumentedSpotify(auth_manager=app_oauth, requests_session=spotify_session)
+# This variable lets us connect to the authorized Spotify user of the current request
+sp = LocalProxy(get_spotify)
+# Runs Spotify and database calls that don't depend on each other at the same time
+io_executor = ThreadPoolExecutor(max_workers=spotify_pool_size, thread_name_prefix='io')
+# The users whose stored playlists are being checked against Spotify in the background
+refreshing_playlists = set()
+refreshing_playlists_lock = threading.Lock()
+# The thread started by start_inspiration_feed
+inspiration_thread = None
+inspiration_thread_lock = threading.Lock()
+
+
+def gather(*calls):
+    '''
+    Runs independent calls concurrently, each with a copy of the current request context,
+    and waits for all of them. The time taken is that of the slowest call instead of the sum.
+
+    Parameters:
+        - calls (function): Functions taking no arguments.
+
+    Returns:
+        - A list of the calls' return values, in the same order as the calls.
+    '''
+    futures = [io_executor.submit(copy_current_request_context(call)) for call in calls]
+    return [future.result() for future in futures]
+
+# Tokens refreshed recently, keyed by the refresh token they replaced. Lets concurrent
+# requests from the same session share one refresh instead of each making their own.
+refreshed_tokens = {}
+refresh_locks = {}
+refresh_locks_lock = threading.Lock()
+
 
 def ensure_valid_token():
-    token_info = sp_oauth.get_cached_token()  # Hämta det nuvarande cached token
-    if not sp_oauth.validate_token(token_info):  # Om token inte är giltigt
-        token_info = sp_oauth.refresh_access_token(token_info['refresh_token'])  # Förnya access token
-        session['token_info'] = token_info  # Uppdatera sessionen med den nya token
+    '''
+    Checks that the user has an access token, and refreshes it if it expires within
+    token_refresh_window seconds. The expiry is checked locally against the token's
+    expires_at, and the result is remembered on flask.g for the rest of the request.
+
+    Returns:
+        - True if the user has a valid token, otherwise False.
+    '''
+    if 'token_valid' in g:
+        return g.token_valid
+
+    token_info = cache_handler.get_cached_token()
+    if not token_info:
+        g.token_valid = False
+        return False
+    if token_info['expires_at'] - int(time.time()) < token_refresh_window:
+        refresh_token(token_info['refresh_token'])
+    g.token_valid = True
+    return True
+
+
+def refresh_token(old_refresh_token):
+    '''
+    Refreshes the access token and saves it in the session. If another request from the
+    same session is already refreshing, waits for it and uses the token it got.
+
+    Parameters:
+        - old_refresh_token (str): The refresh token of the token that is about to expire.
+    '''
+    with refresh_locks_lock:
+        lock = refresh_locks.setdefault(old_refresh_token, threading.Lock())
+
+    with lock:
+        token_info = refreshed_tokens.get(old_refresh_token)
+        if token_info is None or token_info['expires_at'] - int(time.time()) < token_refresh_window:
+            token_info = sp_oauth.refresh_access_token(old_refresh_token)
+            refreshed_tokens[old_refresh_token] = token_info
+
+    with refresh_locks_lock:
+        now = int(time.time())
+        for key, refreshed in list(refreshed_tokens.items()):
+            if refreshed['expires_at'] < now:
+                refreshed_tokens.pop(key, None)
+                refresh_locks.pop(key, None)
+
+    cache_handler.save_token_to_cache(token_info)
+    g.pop('spotify', None)
+    return token_info
 
 def user_info(user):
     ''' 
@@ -53,10 +292,10 @@ def user_info(user):
     Parameters:
         - user: the id of the usr
     '''
-    if not sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if not ensure_valid_token():
         return redirect(url_for('/error'))
     
-    return sp._get('users/' + user)
+    return cache.cached('user_profile', user, lambda: sp._get('users/' + user))
 
 
 def get_user_info(info):
@@ -69,10 +308,10 @@ def get_user_info(info):
     Returns:
         - Various types: Depending on the 'info' parameter, returns different types of user information.
     '''
-    if not sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if not ensure_valid_token():
         return redirect(url_for('/error'))
     
-    current_user = sp.me()
+    current_user = get_current_user()
     if info == 'me':
         return current_user
     elif info == 'username':
@@ -83,17 +322,35 @@ def get_user_info(info):
         return current_user['display_name']
 
 
+def get_current_user():
+    '''
+    Returns the current user's Spotify profile. It is fetched with sp.me() once per login
+    and kept in the session, so the pages using it don't have to ask Spotify again.
+    Only the fields used by the application are kept.
+    '''
+    if 'me' not in session:
+        me = sp.me()
+        session['me'] = {'id': me['id'], 'display_name': me['display_name'], 'images': me['images']}
+    return session['me']
+
+
+def forget_current_user():
+    ''' Removes the stored profile so it is fetched from Spotify the next time it is used. '''
+    session.pop('me', None)
+
+
 def register_user():
     '''
     The function checks if the user is already registered in our database. 
     If it is not, registers them.
     '''
-    if sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if ensure_valid_token():
+        # A session ID from before the login must not lead to the logged in session
+        session.rotate()
+        forget_current_user()
         user_id = get_user_info('username')
         display_name = get_user_info('display_name')
-        registered_user = db.check_user_in_db(user_id)
-        if not registered_user:
-            db.register_user(user_id)
+        db.register_user(user_id, display_name)
         session['logged_in'] = True
         session['user_id'] = user_id
         session['display_name'] = display_name
@@ -108,46 +365,76 @@ def register_user():
 def home():
     ''' 
     Home page for the website.
-    Also shows a list of 5 random tracks for inspiration.
+    Also shows a list of 5 random tracks for inspiration, picked from the precomputed
+    inspiration feed, so the page doesn't have to ask Spotify for anything.
     '''
     if 'user_id' in session: 
         ensure_valid_token()
         
         user_id = session['user_id']
-        '''
-        if 'recommended_tracks' not in session:
-
-            recommended_tracks = recommend_playlist()
-            session['recommended_tracks'] = recommended_tracks
-        else:
-            recommended_tracks = session['recommended_tracks']
-        '''
-        
-        
-        return render_template('logged_in_startpage.html', current_user=user_id)
+        feed = cache.get('inspiration', 'feed')
+        recommended_tracks = random.choice(feed['picks']) if feed and feed['picks'] else None
+        return render_template('logged_in_startpage.html', current_user=user_id, recommended_tracks=recommended_tracks)
 
     else:
         return render_template('index.html')
-    
-'''
-def recommend_playlist():
-        
-        5 tracks selected is shown as inspiration at the landingpage.
-        First a random genre is seleced, and then 5 tracks from that genre.
-        
-        available_genres = sp.recommendation_genre_seeds()['genres']
-        random_genre = random.choice(available_genres)
-        recommendations = sp.recommendations(seed_genres=[random_genre], limit=5,  market='SE')
-
-        recommended_tracks = [{'genre': random_genre}]
-        for track in recommendations['tracks']:
-            track_uri = track ['uri']
-            track_info = f" {track['name']}, by {', ' .join(artist['name'] for artist in track ['artists'])}"
-            
-            recommended_tracks.append({'info': track_info, 'uri': track_uri})
-        return recommended_tracks
 
-'''
+
+def build_inspiration():
+    '''
+    Builds the picks of the inspiration feed. Each pick is a random genre and
+    inspiration_track_count random tracks from its genre pool. The tracks' names
+    are fetched from Spotify in batches of tracks_batch_size.
+
+    Returns:
+        - A list of picks, each a list starting with {'genre': genre} followed by
+          {'info': track_info, 'uri': track_uri} for every track.
+    '''
+    genres = recommender.genres()
+    if not genres:
+        return []
+    picks = []
+    for _ in range(inspiration_pool_size):
+        genre = random.choice(genres)
+        picks.append((genre, recommender.recommend([genre], [inspiration_track_count])))
+
+    uris = list({uri for genre, track_uris in picks for uri in track_uris})
+    track_info = {}
+    for start in range(0, len(uris), tracks_batch_size):
+        for track in app_spotify.tracks(uris[start:start + tracks_batch_size], market='SE')['tracks']:
+            if track:
+                track_info[track['uri']] = f" {track['name']}, by {', ' .join(artist['name'] for artist in track['artists'])}"
+
+    return [[{'genre': genre}] + [{'info': track_info[uri], 'uri': uri} for uri in track_uris if uri in track_info]
+            for genre, track_uris in picks if track_uris]
+
+
+def refresh_inspiration():
+    '''
+    Rebuilds the inspiration feed in the shared cache every inspiration_refresh_interval seconds.
+    Runs in a background thread of every worker, but a feed another worker built recently is kept.
+    '''
+    while True:
+        feed = cache.get('inspiration', 'feed')
+        if feed is None or time.time() - feed['built_at'] >= inspiration_refresh_interval:
+            try:
+                cache.put('inspiration', 'feed', {'built_at': time.time(), 'picks': build_inspiration()})
+            except Exception:
+                app.logger.exception("Could not build the inspiration feed")
+        time.sleep(inspiration_refresh_interval)
+
+
+def start_inspiration_feed():
+    '''
+    Starts refresh_inspiration in a background thread, unless the feed is turned off or already running.
+    Called by gunicorn.conf.py in every worker once the app is loaded, not when main is imported,
+    so scripts and tests that import the app don't build the feed.
+    '''
+    global inspiration_thread
+    with inspiration_thread_lock:
+        if inspiration_refresh_interval > 0 and inspiration_thread is None:
+            inspiration_thread = threading.Thread(target=refresh_inspiration, daemon=True, name='inspiration')
+            inspiration_thread.start()
 
 
 @app.route('/login')
@@ -157,7 +444,7 @@ def login():
     Spotify authorization URL. If they are already authorized they will be redirected
     to 'top-artists'.
     '''
-    if not sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if not ensure_valid_token():
         auth_url = sp_oauth.get_authorize_url()
         return redirect(auth_url)
     flash(f"Du är redan inloggad!")
@@ -187,14 +474,9 @@ def callback():
 
 @app.route('/profile-page')
 def profile_page():
-    ''' Redirects the user to their profile page. '''
-    ensure_valid_token()
-    tracks = sp.playlist_tracks("4ZvJxrLxlmTxfMENidJcM4")
-    items = tracks['items']
-    track_list = []
-    for i in items:
-        track_list.append(i['track']['name'])
-    print(len(track_list))
+    ''' Redirects the user to their profile page, without calling Spotify or the database. '''
+    if 'user_id' not in session:
+        return redirect(url_for('error'))
     username = session['user_id']
     return redirect(url_for('user_profile', username=username))
 
@@ -205,8 +487,8 @@ def users():
     Handle requests to the '/users' route. 
     GET method: renders the 'search_for_users.html' template
     POST method: 
-        - Retrieves the username from the form data.
-        - Searches the database for users matching the provided username.
+        - Retrieves the username and the offset of the results page from the form data.
+        - Searches the database for users matching the provided username or display name.
         - Renders the 'users.html' template with search results if found, 
         or with an indication of no results if not found.
     '''
@@ -214,9 +496,12 @@ def users():
     
     if request.method == 'POST':
         username = request.form['search_user']
-        search_name = db.search_users(username)
+        offset = max(request.form.get('offset', 0, type=int), 0)
+        search_name = db.search_users(username, limit=user_search_page_size + 1, offset=offset)
+        next_offset = offset + user_search_page_size if len(search_name) > user_search_page_size else None
+        search_name = search_name[:user_search_page_size]
         if len(search_name) > 0:
-            return render_template('users.html', username=username, search_name=search_name)
+            return render_template('users.html', username=username, search_name=search_name, next_offset=next_offset)
         else: 
             return render_template('users.html', username=username, search_name=False)
     else:
@@ -228,7 +513,8 @@ def users():
 def user_profile(username):
     '''
     Render the profile page for a specific user.
-    Retrieves information about the specified user and renders their profile page.
+    The user's profile, friendship status and newest comments are loaded with one
+    database query, while the Spotify profile is fetched from the cache at the same time.
 
     Parameters:
         - username (str): The username of the user whose profile page is to be rendered.
@@ -238,21 +524,52 @@ def user_profile(username):
     '''
     ensure_valid_token()
     
-    search_name = db.check_user_in_db(username)
-    if not search_name:
+    current_user = session['user_id']
+
+    def spotify_user():
+        try:
+            return user_info(username)
+        except SpotifyException:
+            return None
+
+    profile, user, friends, my_friends = gather(
+        lambda: db.load_profile(username, current_user, profile_comments_page_size),
+        spotify_user,
+        lambda: get_friends(username),
+        lambda: get_friends(current_user)
+    )
+    if profile is None or user is None:
         return render_template('index.html')
 
-    user = user_info(username)
-    username = user['id']
-    current_user = session['user_id']
-    register_date = db.get_user_r_date(username)
-    print(register_date)
-    is_friend = db.check_if_friends(current_user, username)
     display_name = user['display_name']
     user_image_url = user['images'][0]['url'] if user['images'] else None
-    user_bio = db.get_user_bio(username)
-    user_comments = db.get_user_comments(username)
-    return render_template('profile_page.html', username=username, display_name=display_name, user_image_url=user_image_url,current_user=current_user, user_bio = user_bio, is_friend=is_friend, register_date=register_date, user_comments=user_comments)
+    if profile.username == current_user:
+        mutual_friends = []
+        suggestions = get_friend_suggestions(current_user)
+    else:
+        mutual_friends = sorted(set(friends) & set(my_friends))
+        suggestions = []
+    return render_template('profile_page.html', username=profile.username, display_name=display_name, user_image_url=user_image_url,current_user=current_user, user_bio=profile.bio, is_friend=profile.is_friend, register_date=profile.register_date, user_comments=profile.comments, more_comments=profile.more_comments, friends=friends, mutual_friends=mutual_friends, suggestions=suggestions)
+
+
+def get_friends(user_id):
+    ''' Returns the Spotify IDs of a user's friends, from the cache if they were looked up recently. '''
+    return cache.cached('friends', user_id, lambda: db.list_friends(user_id))
+
+
+def get_friend_suggestions(user_id):
+    '''
+    Returns friends of the user's friends that the user could add, as (s_id, mutual_friends) pairs,
+    from the cache if they were looked up recently.
+    '''
+    return cache.cached('friend_suggestions', user_id, lambda: [list(row) for row in db.friend_suggestions(user_id, friend_suggestions_limit)])
+
+
+def forget_friends(*user_ids):
+    ''' Removes the users' friends and friend suggestions from the cache after a friendship has changed. '''
+    for user_id in user_ids:
+        cache.invalidate('friends', user_id)
+        cache.invalidate('friend_suggestions', user_id)
 
 
 @app.route('/profile-settings')
@@ -278,12 +595,19 @@ def add_friend(user_1, user_2):
     Returns:
         - A redirection to an error page if the token is invalid.
         - A redirection to the second users profile page with a succsess message if the users become friends.
-        - A redirection to the second users profile page with a failure message if the users are already friends. 
+        - A redirection to the second users profile page with a failure message if the users are already friends
+          or are the same user.
     '''
     ensure_valid_token()
     
+    # A friendship is stored with the smallest ID first, and the database rejects a user befriending themselves
+    if user_1 == user_2:
+        flash(f'Du kan inte bli vän med dig själv.')
+        return redirect(url_for('user_profile', username = user_2))
+
     if not db.check_if_friends(user_1, user_2):
         db.become_friends(user_1, user_2)
+        forget_friends(user_1, user_2)
         flash(f"Nu är ni vänner!")
         return redirect(url_for('user_profile', username = user_2))
     
@@ -314,6 +638,7 @@ def remove_friend(user_1, user_2):
     if db.check_if_friends(user_1, user_2):
         flash(f"Du är nu inte längre vän med {user_2}")
         db.remove_friend(user_1, user_2)
+        forget_friends(user_1, user_2)
         return redirect(url_for('user_profile', username=user_2))
     
     else:
@@ -334,7 +659,7 @@ def write_comment(user_1, user_2):
         - A redirection to an error page if the request method is 'GET' or if the token is invalid.
         - A redirection to the second user's profile page with the comment if the comment text is not empty.
     '''
-    if request.method == 'GET' or not sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if request.method == 'GET' or not ensure_valid_token():
         return redirect(url_for('error'))
     
     comment_text = request.form['comment']
@@ -343,6 +668,57 @@ def write_comment(user_1, user_2):
         return redirect(url_for('user_profile', username = user_2, comment_text = comment_text))
 
 
+@app.route('/profile-page/<username>/comments')
+def load_user_comments(username):
+    '''
+    Returns the next page of comments written to a user as JSON, used by the
+    "load more" button on the profile page.
+
+    The page starts after the comment given by the before and before_id query
+    parameters, which are the c_date and c_id of the last comment already shown.
+    Both must be given, or neither for the first page, otherwise 400 is returned.
+    '''
+    if not ensure_valid_token():
+        return jsonify({"message": "Du måste logga in!"}), 401
+
+    before = None
+    if 'before' in request.args or 'before_id' in request.args:
+        try:
+            before = (datetime.fromisoformat(request.args['before']), int(request.args['before_id']))
+        except (KeyError, ValueError):
+            return jsonify({"message": "Ogiltig sida med kommentarer."}), 400
+    comments = db.get_user_comments(username, profile_comments_page_size + 1, before)
+    current_user = session['user_id']
+    for comment in comments:
+        if current_user in (comment['user_one'], comment['user_two']):
+            comment['delete_url'] = url_for('delete_comment', c_id=comment['c_id'])
+    return jsonify({'comments': comments[:profile_comments_page_size], 'more_comments': len(comments) > profile_comments_page_size})
+
+
+@app.route('/delete-comment/<int:c_id>', methods=['GET', 'POST'])
+def delete_comment(c_id):
+    '''
+    Deletes a comment, if the current user wrote it or it was written to them.
+
+    Args:
+        - c_id(int): the ID of the comment.
+
+    Returns:
+        - A redirection to an error page if the request method is 'GET' or if the token is invalid.
+        - A redirection to the profile page the comment was written on.
+    '''
+    if request.method == 'GET' or not ensure_valid_token():
+        return redirect(url_for('error'))
+
+    current_user = session['user_id']
+    profile_user = db.remove_comment(c_id, current_user)
+    if profile_user is None:
+        flash(f"Kommentaren kunde inte tas bort.")
+        return redirect(url_for('user_profile', username=current_user))
+    flash(f"Kommentaren är borttagen!")
+    return redirect(url_for('user_profile', username=profile_user))
+
+
 @app.route('/delete-profile', methods=['GET', 'POST'])
 def delete_profile():
     '''
@@ -354,11 +730,14 @@ def delete_profile():
     if request.method == 'GET':
         return redirect(url_for('error'))
     
-    if sp_oauth.validate_token(cache_handler.get_cached_token()):
+    if ensure_valid_token():
         user_id = session['user_id']
         registered_user = db.check_user_in_db(user_id)
         if registered_user:
+            friends = db.list_friends(user_id)
             db.delete_user(user_id)
+            # The friends' cached friend lists would otherwise still show the deleted user
+            forget_friends(user_id, *friends)
             session.clear()
             flash(f"Du har raderat ditt konto! ")
             return redirect(url_for('home'))
@@ -384,46 +763,68 @@ def write_bio():
 
 @app.route('/top-artists')
 def get_top_artists():
-    '''
-    If the user is authorized they will see their top artists written out on the page.
-    If not, they will be redirected to the Spotify authorization page.
-    '''
-    ensure_valid_token()
-    
-    top_artists = sp.current_user_top_artists()
-    artists = top_artists['items']
-    current_user = session['user_id']
-    return render_template('top-artists.html', artists=artists, current_user=current_user)
+    ''' Redirects to the user's top artists from the last 6 months. '''
+    return redirect(url_for('top_items', item_type='artists', time_range='medium_term'))
 
 
 @app.route('/top-tracks')
 def get_top_tracks():
-    '''
-    If the user is authorized they will se their top tracks (short term) written out on the page.
-    If not, they will be redirected to the Spotify authorization page.
-    '''
-    ensure_valid_token()
-    
-    top_tracks = sp.current_user_top_tracks(limit=20, offset=0, time_range='short_term')
-    tracks = top_tracks['items']
-    current_user = session['user_id']
-    nr = 0
-    return render_template('top-tracks.html', tracks=tracks, nr=nr, current_user=current_user)
+    ''' Redirects to the user's top tracks from the last month. '''
+    return redirect(url_for('top_items', item_type='tracks', time_range='short_term'))
 
 
 @app.route('/top-tracks-months')
 def get_top_tracks_months():
+    ''' Redirects to the user's top tracks from the last 6 months. '''
+    return redirect(url_for('top_items', item_type='tracks', time_range='medium_term'))
+
+
+@app.route('/top/<item_type>')
+def top_items(item_type):
     '''
-    If the user is authorized they will se their top tracks (medium term) written out on the page.
-    If not, they will be redirected to the Spotify authorization page.
+    Shows the user's top artists or tracks for one time range, with tabs for the other
+    time ranges. The items come from the latest stored snapshot, and Spotify is only
+    asked when the snapshot is older than top_items_refresh_interval.
+
+    Parameters:
+        - item_type (str): 'artists' or 'tracks'.
+    The time_range and page query parameters choose the tab and the page of 20 items.
     '''
     ensure_valid_token()
-    
-    top_tracks_months = sp.current_user_top_tracks(limit=20, offset=0, time_range='medium_term')
-    tracks = top_tracks_months['items']
+
+    if item_type not in ('artists', 'tracks'):
+        return redirect(url_for('error_page'))
+    time_range = request.args.get('time_range', 'short_term')
+    if time_range not in top_items_time_ranges:
+        time_range = 'short_term'
+
     current_user = session['user_id']
-    nr = 0
-    return render_template('top-tracks-months.html', tracks=tracks, nr=nr, current_user=current_user)
+    items = get_top_items(current_user, item_type, time_range)
+    page_count = max((len(items) + top_items_page_size - 1) // top_items_page_size, 1)
+    page = min(max(request.args.get('page', 1, type=int), 1), page_count)
+    start = (page - 1) * top_items_page_size
+    return render_template('top-items.html', items=items[start:start + top_items_page_size], start=start, item_type=item_type, time_range=time_range, time_ranges=top_items_time_ranges, page=page, page_count=page_count, current_user=current_user)
+
+
+def get_top_items(user_id, item_type, time_range):
+    '''
+    Returns the user's top artists or tracks, from the latest snapshot in the database if it
+    is recent enough. Otherwise they are fetched from Spotify and saved as a new snapshot.
+    Only the fields shown on the page are kept.
+    '''
+    snapshot = db.get_top_items_snapshot(user_id, item_type, time_range)
+    if snapshot is not None and snapshot[0] < top_items_refresh_interval:
+        return snapshot[1]
+
+    if item_type == 'artists':
+        results = sp.current_user_top_artists(limit=top_items_limit, offset=0, time_range=time_range)
+        items = [{'id': artist['id'], 'name': artist['name']} for artist in results['items']]
+    else:
+        results = sp.current_user_top_tracks(limit=top_items_limit, offset=0, time_range=time_range)
+        items = [{'id': track['id'], 'name': track['name'], 'artists': [artist['name'] for artist in track['artists']]}
+                 for track in results['items']]
+    db.save_top_items_snapshot(user_id, item_type, time_range, items)
+    return items
 
 
 @app.route('/generate-playlist', methods=['GET', 'POST'])
@@ -452,17 +853,12 @@ def generate_playlist():
         playlist_id = playlist['id']
         playlist_uri = playlist['uri']
         playlist_named = playlist['name']
-        playlist_tracks = playlist['tracks']
 
         generate_method = request.form['generate-method']
-        db.add_playlist(playlist_id, playlist_uri, current_user)
+        db.add_playlist(playlist_id, playlist_uri, current_user, playlist_named)
         session['playlist_id'] = playlist_id
         session['playlist_uri'] = playlist_uri  
         session['playlist_named'] = playlist_named
-        session['playlist_tracks'] = playlist_tracks 
-
-        playlist_tracks = len(playlist_tracks)
-        created_date = datetime.now()
 
         if generate_method == 'genres':
             return redirect(url_for('recommendations'))
@@ -477,7 +873,9 @@ def get_playlist(username):
     '''
     Retrieves the user's information and playlist details,
     and renders the playlist page template with this information.
-    If a playlist doesn't exist on Spotify it will be deleted from the database.
+    The page is always rendered from the playlists stored in the database. When a stored
+    name is missing or older than playlist_refresh_interval, the names are checked against
+    Spotify in the background, and the changes are shown the next time the page is loaded.
     '''
     ensure_valid_token()
     
@@ -487,21 +885,13 @@ def get_playlist(username):
     if username == current_user:
         username = current_user
     user_playlists = db.check_playlist(username)
-    user_playlists_spotify = sp.user_playlists(username)
-    
-    spotify_playlist_ids = {playlist['id'] for playlist in user_playlists_spotify['items']}
-
-    for playlist_db in user_playlists:   
-        if playlist_db[0] not in spotify_playlist_ids:
-            db.delete_playlist(playlist_db[0])
+    if any(playlist_is_stale(name_age) for pl_id, pl_name, name_age in user_playlists):
+        refresh_playlists_later(username)
 
     playlists = {"name": [], 'id': []}
-    for playlist in user_playlists:
-        for pl in playlist:
-            playlist_info = sp.playlist(pl)
-            playlist_name = playlist_info['name']
-            playlists['name'].append(playlist_name)
-            playlists['id'].append(pl)
+    for pl_id, pl_name, name_age in user_playlists:
+        playlists['name'].append(pl_name)
+        playlists['id'].append(pl_id)
 
     zipped_playlists = zip(playlists['name'], playlists['id'])
 
@@ -510,53 +900,155 @@ def get_playlist(username):
     return render_template('playlist.html', username=username, display_name=display_name, user_image_url=user_image_url, current_user=current_user)
 
 
-def save_generated_playlist(playlist_id):
+def playlist_is_stale(name_age):
+    '''
+    Returns True if a stored playlist name needs to be checked against Spotify again.
+    name_age is the age of the name as returned by db.check_playlist.
+    '''
+    return name_age is None or name_age > playlist_refresh_interval
+
+
+def refresh_playlists_later(username):
+    '''
+    Runs refresh_playlists in the background with a copy of the current request context.
+    A user whose playlists are already being refreshed isn't refreshed again at the same time.
+    '''
+    with refreshing_playlists_lock:
+        if username in refreshing_playlists:
+            return
+        refreshing_playlists.add(username)
+
+    @copy_current_request_context
+    def refresh():
+        try:
+            refresh_playlists(username)
+        except Exception:
+            app.logger.exception(f"Could not refresh the playlists of {username}")
+        finally:
+            with refreshing_playlists_lock:
+                refreshing_playlists.discard(username)
+
+    io_executor.submit(refresh)
+
+
+def refresh_playlists(username):
+    '''
+    Fetches all of a user's playlists from Spotify, one page of 50 at a time,
+    and syncs the stored playlist names with them. Playlists that no longer
+    exist on Spotify are deleted from the database.
+
+    Parameters:
+        - username (str): The Spotify ID of the user.
+    '''
+    spotify_playlists = {}
+    results = sp.user_playlists(username, limit=50)
+    while results:
+        for playlist in results['items']:
+            spotify_playlists[playlist['id']] = playlist['name']
+        results = sp.next(results) if results['next'] else None
+
+    db.sync_playlist_names(username, spotify_playlists)
+
+
+def save_generated_playlist(playlist_id, playlist_name, nr_songs):
     '''
     Saves information about a generated playlist to the database.
-    The function retrieves the playlist information and its tracks using the Spotify API, 
-    then saves the playlist's name, number of songs, and the date it was created to the database.
+    The information comes straight from the generation, so Spotify doesn't have to be asked again.
+    If the playlist has been generated before, the new tracks are added to its length.
 
     Args:
         - playlist_id(str): the ID of the playlist to be saved.
-    
-    Returns:
-        - A redirection to an error page if the token is invalid.
+        - playlist_name(str): the name of the playlist.
+        - nr_songs(int): the number of songs that were added to the playlist.
     '''
-    ensure_valid_token()
-
-    playlist = sp.playlist(playlist_id)
-    playlist_tracks = sp.playlist_tracks(playlist_id)
-    playlist_items = playlist_tracks['items'] 
-    track_list = []
-    for i in playlist_items:
-        track_list.append(i['track'])
-
-    playlist_name = playlist['name']
-    nr_songs = len(track_list)
     created_date = datetime.now()
     db.generated_playlist_info(playlist_id, playlist_name, nr_songs, created_date)
 
 
+def get_playlist_info(pl_id):
+    '''
+    Returns the name and uri of a playlist, from the cache if it has been fetched recently.
+
+    Parameters:
+        - pl_id (str): The ID of the playlist.
+    '''
+    return cache.cached('playlist', pl_id, lambda: sp.playlist(pl_id, fields='id,name,uri'))
+
+
 @app.route('/playlist/<pl_id>')
 def playlist_page(pl_id):
     '''
     This function tries to open a page showing the contents of a playlist.
-    If a playlist is empty or doesn't exist, it will be deleted from the database.
+    Only the first page of tracks is rendered, the rest are loaded from playlist_tracks
+    when the user scrolls down. The page can be started at another track with the
+    offset and limit query parameters.
     '''
     ensure_valid_token()
     
     delete_button = False
     username = session['user_id']
     display_name = session['display_name']
-    playlist_tracks = sp.playlist_tracks(pl_id)
-    playlist_info = sp.playlist(pl_id)
+    offset, limit = get_page_args(playlist_page_size)
+    (tracks, next_offset), playlist_info, owner_of_playlist = gather(
+        lambda: get_playlist_tracks(pl_id, offset, limit),
+        lambda: get_playlist_info(pl_id),
+        lambda: db.check_if_playlist_is_own(pl_id)
+    )
     playlist_uri = playlist_info['uri']
     playlist_name = playlist_info['name']
-    playlist_items = playlist_tracks['items']
-    owner_of_playlist = db.check_if_playlist_is_own(pl_id)
     if username == owner_of_playlist:
         delete_button = True
-    return render_template('playlist_page.html', playlist_uri=playlist_uri, playlist_name=playlist_name, playlist_items=playlist_items, pl_id=pl_id, current_user=username, display_name=display_name, delete_button=delete_button)
+    return render_template('playlist_page.html', playlist_uri=playlist_uri, playlist_name=playlist_name, tracks=tracks, next_offset=next_offset, page_size=limit, pl_id=pl_id, current_user=username, display_name=display_name, delete_button=delete_button)
+
+
+@app.route('/playlist/<pl_id>/tracks')
+def load_playlist_tracks(pl_id):
+    '''
+    Returns one page of a playlist's tracks as JSON, used by the playlist page
+    to load more tracks when the user scrolls down.
+    '''
+    ensure_valid_token()
+
+    offset, limit = get_page_args(playlist_page_size)
+    tracks, next_offset = get_playlist_tracks(pl_id, offset, limit)
+    return jsonify({'tracks': tracks, 'next_offset': next_offset})
+
+
+def get_page_args(default_limit):
+    ''' Reads the offset and limit query parameters, keeping limit within what Spotify allows. '''
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = request.args.get('limit', default_limit, type=int)
+    limit = min(max(limit, 1), max_playlist_page_size)
+    return offset, limit
+
+
+def get_playlist_tracks(pl_id, offset, limit):
+    '''
+    Fetches one page of tracks from a playlist, keeping only the fields shown on the playlist page.
+
+    Parameters:
+        - pl_id (str): The ID of the playlist.
+        - offset (int): The index of the first track to fetch.
+        - limit (int): The maximum number of tracks to fetch.
+
+    Returns:
+        - A list of tracks, and the offset of the next page or None if this was the last page.
+    '''
+    page = sp.playlist_tracks(pl_id, fields=playlist_track_fields, limit=limit, offset=offset)
+    tracks = []
+    for item in page['items']:
+        track = item['track']
+        if not track:
+            continue
+        images = track['album']['images']
+        tracks.append({
+            'name': track['name'],
+            'artist': track['artists'][0]['name'] if track['artists'] else None,
+            'album': track['album']['name'],
+            'image': images[0]['url'] if images else None,
+        })
+    next_offset = offset + limit if offset + limit < page['total'] else None
+    return tracks, next_offset
 
 
 @app.route('/redirect-playlist')
@@ -582,6 +1074,7 @@ def delete_playlist(pl_id):
     username = session['user_id']
     sp.current_user_unfollow_playlist(pl_id)
     db.delete_playlist(pl_id)
+    cache.invalidate('playlist', pl_id)
     flash(f"Spellistan borttagen!")
     return redirect(url_for('get_playlist', username=username))
 
@@ -592,50 +1085,55 @@ def recommendations():
     If the user reaches this page using the GET method they will be
     presented with a list of genres to choose from, as well as a slider. When clicking
     the button at the bottom of the form they will generate as many songs they wanted
-    generated from the genres they chose. If the POST method was used, they will be presented with
-    a pop up notifying them that their playlist was made, then redirected to the home page.
-    For the POST method the function is using JavaScript for storing the genres chosen and handling the redirection.
+    generated from the genres they chose. If the POST method was used, the playlist is generated
+    by a background job and the ID of the job is returned. The JavaScript polls the job's status
+    and presents a pop up when the playlist is made, then redirects to the playlist page.
     '''
     ensure_valid_token()
     
-    recco_list = sp.recommendation_genre_seeds()
     if request.method == 'POST':
         if request.is_json:
             data = request.json
             genre_seeds = data.get('genres')
             recco_limit = data.get('recco_limit')
-            print(genre_seeds)
         else:
-            genre_seeds = request.form['genres']
+            genre_seeds = request.form.getlist('genres')
             recco_limit = request.form['recco_limit']
 
-        reccos = sp.recommendations(seed_genres=genre_seeds, limit=recco_limit, market='SE')
-
         if 'playlist_id' in session:
             playlist_id = session['playlist_id']
-            track_list = []
-    
-            for track in reccos['tracks']:
-                song_uri = track['uri']
-                track_list.append(song_uri)
-            sp.playlist_add_items(playlist_id, track_list, position=None)
-            save_generated_playlist(playlist_id)
+            playlist_name = session['playlist_named']
+            return start_generation(generate_from_genres, playlist_id, playlist_name, genre_seeds, recco_limit)
         return jsonify({"message": "Spellista skapad!"}), 200
     
     else:
         current_user = session['user_id']
+        recco_list = get_genre_seeds()
         return render_template('recommendations.html', recco_list=recco_list, current_user=current_user)
 
 
+def get_genre_seeds():
+    '''
+    Returns the genres that can be chosen on the recommendations page, as {'genres': [...]}.
+    They come from Spotify's list of genre seeds, or from the genres of the local genre pools
+    if Spotify can't give the list.
+    '''
+    try:
+        return cache.cached('genre_seeds', 'all', sp.recommendation_genre_seeds)
+    except (SpotifyException, requests.RequestException) as e:
+        app.logger.warning(f"Spotify genre seeds unavailable: {str(e)}")
+        return {'genres': sorted(set(recommender.genres()) | set(recommender.default_genres))}
+
+
 @app.route('/search', methods=['GET', 'POST'])
 def search():
     '''
     If the user reaches this page using the GET method they will be
     presented with a list of decade to choose from, as well as a slider. When clicking
     the button at the bottom of the form they will generate as many songs they wanted
-    generated from the decades they chose. If the POST method was used, they will be presented with
-    a pop up notifying them that their playlist was made, then redirected to the home page.
-    For the POST method the function is using JavaScript for storing the decades chosen and handling the redirection.
+    generated from the decades they chose. If the POST method was used, the playlist is generated
+    by a background job and the ID of the job is returned. The JavaScript polls the job's status
+    and presents a pop up when the playlist is made, then redirects to the playlist page.
     '''
     ensure_valid_token()
     
@@ -652,18 +1150,9 @@ def search():
 
         if 'playlist_id' in session:
             playlist_id = session['playlist_id']
-            track_list = []  
-
-            for decade in decades:
-                searches = sp.search(q=f'year:{decades_ranges[decade]}', type='track', limit=search_limit, market='SE')
-                for track in searches['tracks']['items']:
-                    audio_features = sp.audio_features(track['uri'])[0]
-                    if audio_features['speechiness'] < 0.7:
-                        if len(track_list) < int(search_limit):
-                            track_list.append(track['uri'])
-
-            sp.playlist_add_items(playlist_id, track_list, position=None)
-            save_generated_playlist(playlist_id)
+            year_ranges = [decades_ranges[decade] for decade in decades]
+            playlist_name = session['playlist_named']
+            return start_generation(generate_from_years, playlist_id, playlist_name, year_ranges, search_limit)
         return jsonify({"message": "Spellista skapad!"}), 200
     
     else:
@@ -671,6 +1160,300 @@ def search():
         return render_template('search.html', decades=decades_ranges.keys(), current_user=current_user)
 
 
+def start_generation(generate, playlist_id, playlist_name, *args):
+    '''
+    Starts generating a playlist in the background worker pool. The job runs with a copy
+    of the current request context, so it can use the user's session and Spotify token.
+
+    Parameters:
+        - generate (function): generate_from_genres or generate_from_years.
+        - playlist_id (str): The ID of the playlist to add the tracks to.
+        - playlist_name (str): The name of the playlist.
+        - args: The rest of the arguments to generate.
+
+    Returns:
+        - A JSON response with the ID of the job and the URL to poll for its status.
+    '''
+    job_id = jobs.submit(session['user_id'], copy_current_request_context(generate), playlist_id, playlist_name, *args)
+    return jsonify({"message": "Spellistan skapas!", "job_id": job_id, "status_url": url_for('job_status', job_id=job_id)}), 202
+
+
+def generate_from_genres(progress, playlist_id, playlist_name, genre_seeds, recco_limit):
+    '''
+    Adds recommended tracks for the genres to the playlist, split evenly between the genres.
+    The tracks are picked from the local genre pools, and Spotify is only searched for genres
+    the pools don't have enough tracks from yet. If that isn't enough, Spotify's recommendations
+    are used for the rest, when they are available. Runs as a background job.
+    '''
+    if not genre_seeds:
+        return "Välj minst en genre."
+    recco_limit = int(recco_limit)
+    quotas = split_evenly(recco_limit, len(genre_seeds))
+    progress(0, 3)
+    missing = [genre for genre, quota in zip(genre_seeds, quotas) if recommender.count(genre) < quota * catalog_pool_factor]
+    if missing:
+        fill_genre_pools(missing)
+    progress(1, 3)
+    track_list = recommender.recommend(genre_seeds, quotas)
+    if len(track_list) < recco_limit:
+        track_list += spotify_recommendations(genre_seeds, recco_limit - len(track_list), exclude=set(track_list))
+    progress(2, 3)
+    message = write_generated_tracks(playlist_id, playlist_name, track_list)
+    progress(3, 3)
+    return message
+
+
+def fill_genre_pools(genres):
+    '''
+    Searches Spotify for a page of tracks from each genre, starting at a random result, and adds
+    them to the genre pools with their popularity and audio features. A genre that can't be
+    searched right now is skipped, so the tracks already in the pools can still be used.
+    '''
+    def search_genre(genre):
+        try:
+            offset = random.randrange(spotify_search_max_offset - catalog_fill_size)
+            tracks = sp.search(q=f'genre:"{genre}"', type='track', limit=catalog_fill_size, offset=offset, market='SE')['tracks']['items']
+            if not tracks:
+                tracks = sp.search(q=f'genre:"{genre}"', type='track', limit=catalog_fill_size, offset=0, market='SE')['tracks']['items']
+            return tracks
+        except (SpotifyException, requests.RequestException) as e:
+            app.logger.warning(f"Could not search genre {genre}: {str(e)}")
+            return []
+
+    results = gather(*[lambda genre=genre: search_genre(genre) for genre in genres])
+    uris = list({track['uri'] for tracks in results for track in tracks})
+    try:
+        audio_features = get_audio_features(uris)
+    except (SpotifyException, requests.RequestException) as e:
+        app.logger.warning(f"Could not get audio features: {str(e)}")
+        return
+
+    genre_tracks = []
+    for genre, tracks in zip(genres, results):
+        for track in tracks:
+            track_features = audio_features.get(track['uri'])
+            if track_features:
+                genre_tracks.append((genre, track['uri'], track['popularity'], track_features['speechiness'])
+                                    + tuple(track_features[feature] for feature in recommender.features))
+    recommender.add_tracks(genre_tracks)
+
+
+def spotify_recommendations(genre_seeds, limit, exclude=()):
+    '''
+    Returns the URIs of Spotify's recommendations for the genres, or an empty list if the
+    recommendations endpoint is unavailable.
+    '''
+    try:
+        reccos = sp.recommendations(seed_genres=genre_seeds, limit=min(limit, 100), market='SE')
+    except (SpotifyException, requests.RequestException) as e:
+        app.logger.warning(f"Spotify recommendations unavailable: {str(e)}")
+        return []
+    return [track['uri'] for track in reccos['tracks'] if track['uri'] not in exclude]
+
+
+def split_evenly(total, parts):
+    ''' Splits total into parts whole numbers that differ by at most one, e.g. 10 into 3 is [4, 3, 3]. '''
+    return [total // parts + (1 if i < total % parts else 0) for i in range(parts)]
+
+
+def generate_from_years(progress, playlist_id, playlist_name, year_ranges, search_limit):
+    '''
+    Adds random tracks from the year ranges to the playlist, split evenly between the ranges.
+    The tracks are picked from the local track catalog, and Spotify is only searched for
+    year ranges the catalog doesn't know enough tracks from yet. Runs as a background job.
+    '''
+    if not year_ranges:
+        return "Välj minst ett årtionde."
+    search_limit = int(search_limit)
+    quotas = split_evenly(search_limit, len(year_ranges))
+    progress(0, 3)
+    missing = [year_range for year_range, quota in zip(year_ranges, quotas) if catalog.count(year_range) < quota * catalog_pool_factor]
+    if missing:
+        fill_catalog(missing)
+    progress(1, 3)
+    track_list = []
+    for year_range, quota in zip(year_ranges, quotas):
+        track_list += catalog.sample(year_range, quota, exclude=set(track_list))
+    if not track_list:
+        return "Inga låtar hittades just nu. Försök igen lite senare."
+    progress(2, 3)
+    message = write_generated_tracks(playlist_id, playlist_name, track_list)
+    progress(3, 3)
+    return message
+
+
+def fill_catalog(year_ranges):
+    '''
+    Searches Spotify for a page of tracks from each year range, starting at a random result,
+    and adds them to the track catalog with their release year, popularity and speechiness.
+    A year range that can't be searched right now is skipped, so the tracks already in the
+    catalog can still be used.
+    '''
+    tracks = search_years(year_ranges)
+    try:
+        speechiness = get_speechiness([track['uri'] for track in tracks])
+    except (SpotifyException, requests.RequestException) as e:
+        app.logger.warning(f"Could not get audio features: {str(e)}")
+        return
+    catalog_tracks = []
+    for track in tracks:
+        release_year = track['album']['release_date'][:4]
+        if track['uri'] in speechiness and release_year.isdigit():
+            catalog_tracks.append((track['uri'], int(release_year), track['popularity'], speechiness[track['uri']]))
+    catalog.add_tracks(catalog_tracks)
+
+
+def write_generated_tracks(playlist_id, playlist_name, track_list):
+    '''
+    Adds the generated tracks to the playlist and saves the playlist's info. If Spotify keeps
+    failing partway through, the tracks that were added are still saved, and the message
+    tells the user how many of them made it.
+
+    Returns:
+        - The message shown to the user when the job is done.
+    '''
+    try:
+        nr_songs = add_tracks_to_playlist(playlist_id, track_list)
+    except PlaylistWriteError as e:
+        app.logger.warning(f"{str(e)}: {str(e.__cause__)}")
+        if e.written:
+            save_generated_playlist(playlist_id, playlist_name, e.written)
+        return f"Bara {e.written} av {len(track_list)} låtar kunde läggas till i spellistan. Försök igen lite senare."
+    save_generated_playlist(playlist_id, playlist_name, nr_songs)
+    return "Spellista skapad!"
+
+
+class PlaylistWriteError(Exception):
+    '''
+    Raised when a chunk of tracks couldn't be added to a playlist.
+    written is the number of tracks that were added before it.
+    '''
+
+    def __init__(self, playlist_id, written):
+        super().__init__(f"Could not add tracks to playlist {playlist_id} after the first {written}")
+        self.playlist_id = playlist_id
+        self.written = written
+
+
+def add_tracks_to_playlist(playlist_id, track_uris):
+    '''
+    Adds tracks to a playlist in chunks of playlist_write_chunk_size, in order.
+    The chunks are sent with get_playlist_writer, so this is the only place they are retried.
+    A chunk that is rate limited is retried after the Retry-After time Spotify asks for, and a
+    chunk that fails with a server or connection error is retried with jittered exponential backoff,
+    up to playlist_write_retries times. Chunks that were already added are never sent again.
+
+    Parameters:
+        - playlist_id (str): The ID of the playlist.
+        - track_uris (list): The URIs of the tracks to add.
+
+    Returns:
+        - The number of tracks added.
+
+    Raises:
+        - PlaylistWriteError: If a chunk still fails after its retries.
+    '''
+    writer = get_playlist_writer()
+    written = 0
+    while written < len(track_uris):
+        chunk = track_uris[written:written + playlist_write_chunk_size]
+        for attempt in range(playlist_write_retries + 1):
+            try:
+                writer.playlist_add_items(playlist_id, chunk, position=None)
+                break
+            except (SpotifyException, requests.RequestException) as e:
+                retryable = not isinstance(e, SpotifyException) or e.http_status == 429 or e.http_status >= 500
+                if attempt == playlist_write_retries or not retryable:
+                    raise PlaylistWriteError(playlist_id, written) from e
+                time.sleep(retry_delay(e, attempt))
+        written += len(chunk)
+    return written
+
+
+def retry_delay(error, attempt):
+    ''' Returns the seconds to wait before retrying a failed Spotify request. '''
+    retry_after = (getattr(error, 'headers', None) or {}).get('Retry-After')
+    if getattr(error, 'http_status', None) == 429 and retry_after:
+        return int(retry_after) + random.uniform(0, 1)
+    return random.uniform(0, 2 ** attempt)
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    '''
+    Returns the status of a playlist generation job as JSON. Polled by the
+    JavaScript on the recommendations and search pages.
+    '''
+    if 'user_id' not in session:
+        return jsonify({"message": "Du måste logga in!"}), 401
+
+    job = jobs.get(job_id, session['user_id'])
+    if job is None:
+        return jsonify({"message": "Jobbet finns inte."}), 404
+    if job['status'] == 'failed':
+        job['message'] = "Något gick fel när spellistan skapades. Försök igen lite senare."
+    return jsonify(job), 200
+
+
+def search_years(year_ranges):
+    '''
+    Searches Spotify for a page of tracks from each year range. Each search starts at a random
+    result so that new tracks are found every time. The searches run concurrently, and a year
+    range that can't be searched right now gets no tracks.
+
+    Parameters:
+        - year_ranges (list): Year ranges in Spotify's search format, e.g. '1990-1999'.
+
+    Returns:
+        - A list of Spotify track objects.
+    '''
+    def search_year(year_range):
+        try:
+            offset = random.randrange(spotify_search_max_offset - catalog_fill_size)
+            searches = sp.search(q=f'year:{year_range}', type='track', limit=catalog_fill_size, offset=offset, market='SE')
+            if not searches['tracks']['items']:
+                searches = sp.search(q=f'year:{year_range}', type='track', limit=catalog_fill_size, offset=0, market='SE')
+            return searches['tracks']['items']
+        except (SpotifyException, requests.RequestException) as e:
+            app.logger.warning(f"Could not search years {year_range}: {str(e)}")
+            return []
+
+    results = gather(*[lambda year_range=year_range: search_year(year_range) for year_range in year_ranges])
+    return [track for tracks in results for track in tracks]
+
+
+def get_speechiness(track_uris):
+    '''
+    Returns the speechiness of tracks.
+
+    Parameters:
+        - track_uris (list): The URIs of the tracks.
+
+    Returns:
+        - A dict mapping the URIs to their speechiness. Tracks without audio features are left out.
+    '''
+    return {uri: audio_features['speechiness'] for uri, audio_features in get_audio_features(track_uris).items()}
+
+
+def get_audio_features(track_uris):
+    '''
+    Returns the audio features of tracks. They are requested in batches of audio_features_batch_size.
+
+    Parameters:
+        - track_uris (list): The URIs of the tracks.
+
+    Returns:
+        - A dict mapping the URIs to their audio features. Tracks without audio features are left out.
+    '''
+    audio_features = {}
+    for start in range(0, len(track_uris), audio_features_batch_size):
+        batch = track_uris[start:start + audio_features_batch_size]
+        for uri, track_features in zip(batch, sp.audio_features(batch)):
+            if track_features:
+                audio_features[uri] = track_features
+    return audio_features
+
+
 @app.route('/logout')
 def logout():
     ''' The logout page is used to clear the Flask session. '''
@@ -699,6 +1482,16 @@ def error_page():
     
     return render_template('error.html')
 
+@app.route('/cache-stats')
+def cache_stats():
+    ''' Shows how often the Spotify lookups are served from the cache, used to size it. '''
+    return jsonify(cache.stats())
+
+@app.route('/metrics')
+def get_metrics():
+    ''' Shows the timings of routes, database functions, Spotify endpoints and templates for Prometheus. '''
+    return Response(metrics.render(cache.stats()), mimetype='text/plain; version=0.0.4')
+
 @app.route('/about')
 def about():
     '''
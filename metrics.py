@@ -0,0 +1,173 @@
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from flask import has_request_context, request, before_render_template, template_rendered
+
+# Upper bounds in seconds of the latency histogram buckets
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_lock = threading.Lock()
+# (kind, name) mapped to [bucket counts..., count, sum]
+_histograms = {}
+# (route, status) mapped to the number of responses
+_responses = {}
+
+
+def observe(kind, name, seconds):
+    '''
+    Records how long something took, both in the process-wide histograms and in the
+    breakdown of the current request.
+
+    Parameters:
+        - kind (str): What was timed: 'route', 'db', 'spotify' or 'template'.
+        - name (str): The route, db.py function, Spotify endpoint or template.
+        - seconds (float): The time it took.
+    '''
+    with _lock:
+        histogram = _histograms.get((kind, name))
+        if histogram is None:
+            histogram = _histograms[(kind, name)] = [0] * (len(buckets) + 2)
+        index = bisect_left(buckets, seconds)
+        if index < len(buckets):
+            histogram[index] += 1
+        histogram[-2] += 1
+        histogram[-1] += seconds
+
+    if kind != 'route' and has_request_context():
+        timings = request.environ.get('rr.timings')
+        if timings is not None:
+            timings.add(kind, seconds)
+
+
+def count_response(route, status):
+    ''' Counts a response by route and status code. '''
+    with _lock:
+        _responses[(route, status)] = _responses.get((route, status), 0) + 1
+
+
+@contextmanager
+def timed(kind, name):
+    ''' Times the block and records it with observe. '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(kind, name, time.perf_counter() - started)
+
+
+def instrument(kind, name, function):
+    ''' Returns a wrapper of function that records how long every call takes. '''
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with timed(kind, name):
+            return function(*args, **kwargs)
+    return wrapper
+
+
+def instrument_module(module, kind, exclude=()):
+    '''
+    Replaces every public function defined in a module with a timed wrapper.
+    Calls made through the module, e.g. db.load_profile(), are then recorded under the function's name.
+    '''
+    for name, value in list(vars(module).items()):
+        if callable(value) and getattr(value, '__module__', None) == module.__name__ \
+                and not name.startswith('_') and not isinstance(value, type) and name not in exclude:
+            setattr(module, name, instrument(kind, name, value))
+
+
+class RequestTimings:
+    ''' The time one request has spent on each kind of work, including work done in other threads. '''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, kind, seconds):
+        with self._lock:
+            self.totals[kind] = self.totals.get(kind, 0) + seconds
+
+    def server_timing(self):
+        ''' Returns the breakdown as the value of a Server-Timing header, in milliseconds. '''
+        with self._lock:
+            parts = [f'{kind};dur={seconds * 1000:.1f}' for kind, seconds in sorted(self.totals.items())]
+        parts.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+
+def render(cache_stats=None):
+    '''
+    Returns all metrics in the Prometheus text format.
+
+    Parameters:
+        - cache_stats (dict): The result of cache.stats(), added as hit and miss counters.
+    '''
+    with _lock:
+        histograms = {key: list(value) for key, value in _histograms.items()}
+        responses = dict(_responses)
+
+    lines = ['# TYPE rhythmroulette_duration_seconds histogram']
+    for (kind, name), histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, histogram):
+            cumulative += bucket_count
+            lines.append(f'rhythmroulette_duration_seconds_bucket{_labels(kind=kind, name=name, le=bound)} {cumulative}')
+        lines.append(f'rhythmroulette_duration_seconds_bucket{_labels(kind=kind, name=name, le="+Inf")} {histogram[-2]}')
+        lines.append(f'rhythmroulette_duration_seconds_count{_labels(kind=kind, name=name)} {histogram[-2]}')
+        lines.append(f'rhythmroulette_duration_seconds_sum{_labels(kind=kind, name=name)} {histogram[-1]:.6f}')
+
+    lines.append('# TYPE rhythmroulette_responses_total counter')
+    for (route, status), count in sorted(responses.items()):
+        lines.append(f'rhythmroulette_responses_total{_labels(route=route, status=status)} {count}')
+
+    if cache_stats:
+        lines.append('# TYPE rhythmroulette_cache_requests_total counter')
+        for endpoint, counts in sorted(cache_stats['endpoints'].items()):
+            for result, count in sorted(counts.items()):
+                lines.append(f'rhythmroulette_cache_requests_total{_labels(endpoint=endpoint, result=result)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app, timing_header=False):
+    '''
+    Times every request and every rendered template of a Flask app.
+
+    Parameters:
+        - app (Flask): The app.
+        - timing_header (bool): Whether to add a Server-Timing header with the
+          request's breakdown to every response.
+    '''
+    @app.before_request
+    def start_timing():
+        request.environ['rr.timings'] = RequestTimings()
+
+    @app.after_request
+    def stop_timing(response):
+        timings = request.environ.get('rr.timings')
+        if timings is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            observe('route', route, time.perf_counter() - timings.started)
+            count_response(route, response.status_code)
+            if timing_header:
+                response.headers['Server-Timing'] = timings.server_timing()
+        return response
+
+    template_started = threading.local()
+
+    def start_template(sender, template, context, **extra):
+        template_started.value = time.perf_counter()
+
+    def stop_template(sender, template, context, **extra):
+        started = getattr(template_started, 'value', None)
+        if started is not None:
+            observe('template', template.name, time.perf_counter() - started)
+
+    before_render_template.connect(start_template, app, weak=False)
+    template_rendered.connect(stop_template, app, weak=False)
@@ -0,0 +1,84 @@
+'''
+Brings the database schema up to date by applying the SQL files in the migrations folder.
+
+Every migration is named NNNN_description.sql and is applied once, in order of its number,
+in a transaction of its own. The applied migrations are recorded in the schema_migrations table.
+The migrations are written so they can also be applied to a database that was created with
+the old schema script, before the schema_migrations table existed.
+
+Run from the repository's root folder, with the database configured as for db.py:
+    python migrate.py
+'''
+import os
+import re
+
+migrations_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+# Taken for the duration of every migration, so workers starting at the same time don't apply it twice
+lock_id = 8724501
+
+
+def migrations():
+    '''
+    Returns the migrations in the migrations folder as (version, name, path) tuples, sorted by version.
+    '''
+    found = []
+    for filename in os.listdir(migrations_dir):
+        match = re.fullmatch(r'(\d+)_(\w+)\.sql', filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(migrations_dir, filename)))
+    found.sort()
+    versions = [version for version, name, path in found]
+    if len(set(versions)) != len(versions):
+        raise ValueError("Two migrations have the same version number")
+    return found
+
+
+def migrate(conn):
+    '''
+    Applies the migrations that haven't been applied to the database yet.
+
+    Parameters:
+        - conn: A psycopg2 connection to the database.
+    Returns:
+        - The names of the migrations that were applied.
+    '''
+    with conn:
+        with conn.cursor() as cur:
+            cur.execute(
+                '''
+                CREATE TABLE IF NOT EXISTS schema_migrations(
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(100),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+                '''
+            )
+
+    applied = []
+    for version, name, path in migrations():
+        with open(path, encoding='utf-8') as file:
+            sql = file.read()
+        # Leaving the with block commits the migration, or rolls it back if it raises
+        with conn:
+            with conn.cursor() as cur:
+                cur.execute('SELECT pg_advisory_xact_lock(%s)', (lock_id,))
+                cur.execute('SELECT 1 FROM schema_migrations WHERE version = %s', (version,))
+                if cur.fetchone() is not None:
+                    continue
+                cur.execute(sql)
+                cur.execute('INSERT INTO schema_migrations(version, name) VALUES (%s, %s)', (version, name))
+        applied.append(f'{version:04d}_{name}')
+    return applied
+
+
+if __name__ == '__main__':
+    import db
+
+    conn = db.init_pool().getconn()
+    try:
+        applied = migrate(conn)
+    finally:
+        db.connection_pool.putconn(conn)
+    for name in applied:
+        print(f"Applied {name}")
+    print(f"The database schema is up to date, {len(applied)} migrations applied")
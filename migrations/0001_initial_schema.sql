@@ -1,16 +1,10 @@
-CREATE TABLE a_user(
-	s_id VARCHAR(30),
+CREATE TABLE IF NOT EXISTS a_user(
+	s_id VARCHAR(30) PRIMARY KEY,
 	r_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-	);
-	
-INSERT INTO a_user
-VALUES ('test');
-
-ALTER TABLE a_user
-ADD PRIMARY KEY (s_id);
+);
 
-Sambandstabell
-CREATE TABLE friends_with(
+-- Sambandstabell
+CREATE TABLE IF NOT EXISTS friends_with(
 	user_one VARCHAR(30),
 	user_two VARCHAR(30),
 	f_date DATE DEFAULT CURRENT_DATE,
@@ -19,15 +13,14 @@ CREATE TABLE friends_with(
 	FOREIGN KEY (user_two) REFERENCES a_user(s_id) ON DELETE CASCADE
 );
 
-CREATE TABLE playlist(
+CREATE TABLE IF NOT EXISTS playlist(
 	pl_id VARCHAR(40) PRIMARY KEY,
 	pl_url VARCHAR(60),
 	user_id VARCHAR(30),
 	FOREIGN KEY (user_id) REFERENCES a_user(s_id) ON DELETE CASCADE
 );
 
-
-CREATE TABLE comment_user(
+CREATE TABLE IF NOT EXISTS comment_user(
 	c_id SERIAL PRIMARY KEY,
 	user_one VARCHAR(30),
 	user_two VARCHAR (30),
@@ -37,8 +30,7 @@ CREATE TABLE comment_user(
 	FOREIGN KEY (user_two) REFERENCES a_user (s_id)
 );
 
-
-CREATE TABLE comment_playlist(
+CREATE TABLE IF NOT EXISTS comment_playlist(
 	c_id SERIAL PRIMARY KEY,
 	user_id VARCHAR(30),
 	pl_id VARCHAR(40),
@@ -47,6 +39,3 @@ CREATE TABLE comment_playlist(
 	FOREIGN KEY (user_id)  REFERENCES a_user(s_id) ON DELETE CASCADE,
 	FOREIGN KEY (pl_id) REFERENCES playlist(pl_id)	ON DELETE CASCADE
 );
-
-
-
@@ -0,0 +1,3 @@
+ALTER TABLE playlist
+ADD COLUMN IF NOT EXISTS pl_name VARCHAR(100),
+ADD COLUMN IF NOT EXISTS name_checked TIMESTAMP;
@@ -0,0 +1,7 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE a_user
+ADD COLUMN IF NOT EXISTS display_name VARCHAR(100);
+
+CREATE INDEX IF NOT EXISTS a_user_s_id_trgm_idx ON a_user USING GIN (s_id gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS a_user_display_name_trgm_idx ON a_user USING GIN (display_name gin_trgm_ops);
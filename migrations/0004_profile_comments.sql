@@ -0,0 +1 @@
+CREATE INDEX IF NOT EXISTS comment_user_user_two_c_date_idx ON comment_user (user_two, c_date DESC, c_id DESC);
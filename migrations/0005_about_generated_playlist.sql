@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS about_generated_playlist(
+	pl_id VARCHAR(40) PRIMARY KEY,
+	playlist_name VARCHAR(100),
+	playlist_length INTEGER,
+	last_updated_datetime TIMESTAMP,
+	FOREIGN KEY (pl_id) REFERENCES playlist(pl_id) ON DELETE CASCADE
+);
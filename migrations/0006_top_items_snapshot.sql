@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS top_items_snapshot(
+	user_id VARCHAR(30),
+	item_type VARCHAR(10),
+	time_range VARCHAR(15),
+	taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+	items JSONB,
+	PRIMARY KEY (user_id, item_type, time_range, taken_at),
+	FOREIGN KEY (user_id) REFERENCES a_user(s_id) ON DELETE CASCADE
+);
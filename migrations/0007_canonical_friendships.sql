@@ -0,0 +1,22 @@
+-- Every friendship is stored once, with the smallest ID in user_one.
+-- Friendships stored in both directions keep only the row that is already in order.
+DELETE FROM friends_with f
+WHERE f.user_one > f.user_two
+  AND EXISTS (SELECT 1 FROM friends_with r WHERE r.user_one = f.user_two AND r.user_two = f.user_one);
+
+UPDATE friends_with
+SET user_one = user_two, user_two = user_one
+WHERE user_one > user_two;
+
+-- Users who befriended themselves before that was stopped would break the constraint
+DELETE FROM friends_with WHERE user_one = user_two;
+
+DO $$
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'friends_with_ordered') THEN
+		ALTER TABLE friends_with
+		ADD CONSTRAINT friends_with_ordered CHECK (user_one < user_two);
+	END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS friends_with_user_two_idx ON friends_with (user_two, user_one);
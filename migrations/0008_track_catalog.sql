@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS track_catalog(
+	uri VARCHAR(60) PRIMARY KEY,
+	release_year SMALLINT,
+	popularity SMALLINT,
+	speechiness REAL,
+	added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+ALTER TABLE a_user
+ADD COLUMN IF NOT EXISTS user_bio TEXT;
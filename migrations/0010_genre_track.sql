@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS genre_track(
+	genre VARCHAR(50),
+	uri VARCHAR(60),
+	popularity SMALLINT,
+	speechiness REAL,
+	danceability REAL,
+	energy REAL,
+	valence REAL,
+	acousticness REAL,
+	instrumentalness REAL,
+	added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+	PRIMARY KEY (genre, uri)
+);
@@ -0,0 +1,14 @@
+-- The playlists page looks up a user's playlists by user_id
+CREATE INDEX IF NOT EXISTS playlist_user_id_idx ON playlist (user_id);
+
+-- Deleting a user or a playlist looks up the rows referring to it
+CREATE INDEX IF NOT EXISTS comment_user_user_one_idx ON comment_user (user_one);
+CREATE INDEX IF NOT EXISTS comment_playlist_user_id_idx ON comment_playlist (user_id);
+CREATE INDEX IF NOT EXISTS comment_playlist_pl_id_idx ON comment_playlist (pl_id);
+
+-- Deleting a profile deletes the comments written by and to the user, like their other rows
+ALTER TABLE comment_user
+DROP CONSTRAINT IF EXISTS comment_user_user_one_fkey,
+DROP CONSTRAINT IF EXISTS comment_user_user_two_fkey,
+ADD CONSTRAINT comment_user_user_one_fkey FOREIGN KEY (user_one) REFERENCES a_user(s_id) ON DELETE CASCADE,
+ADD CONSTRAINT comment_user_user_two_fkey FOREIGN KEY (user_two) REFERENCES a_user(s_id) ON DELETE CASCADE;
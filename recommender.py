@@ -0,0 +1,146 @@
+import os
+import threading
+from array import array
+from dotenv import load_dotenv
+import sampling
+from sampling import max_speechiness
+
+load_dotenv()
+
+# Seconds between reloads of the genre pools from the database, to pick up tracks added by other workers.
+reload_interval = int(os.environ.get("genre_pool_reload_interval", 10 * 60))
+# The audio features compared between tracks, all between 0 and 1
+features = ('danceability', 'energy', 'valence', 'acousticness', 'instrumentalness')
+# How much the distance to the other chosen genres matters compared to popularity
+similarity_weight = 4
+# Offered on the recommendations page when Spotify's list of genre seeds can't be fetched
+default_genres = ['acoustic', 'alternative', 'blues', 'classical', 'country', 'dance', 'disco', 'electronic', 'folk',
+                  'funk', 'hip-hop', 'indie', 'jazz', 'metal', 'pop', 'punk', 'r-n-b', 'reggae', 'rock', 'soul', 'swedish']
+
+
+class GenrePool:
+    ''' The tracks of one genre, stored column by column in compact arrays. '''
+
+    def __init__(self):
+        self.uris = []
+        self.popularity = array('B')
+        self.speechiness = array('f')
+        # The features of track i are at [i * len(features), (i + 1) * len(features))
+        self.features = array('f')
+        self._positions = {}
+
+    def add(self, uri, popularity, speechiness, track_features):
+        position = self._positions.get(uri)
+        if position is None:
+            self._positions[uri] = len(self.uris)
+            self.uris.append(uri)
+            self.popularity.append(popularity)
+            self.speechiness.append(speechiness)
+            self.features.extend(track_features)
+        else:
+            self.popularity[position] = popularity
+            self.speechiness[position] = speechiness
+            self.features[position * len(features):(position + 1) * len(features)] = array('f', track_features)
+
+    def playable(self):
+        ''' Returns the positions of the tracks that aren't mostly talk. '''
+        return [i for i, speechiness in enumerate(self.speechiness) if speechiness < max_speechiness]
+
+    def centroid(self):
+        ''' Returns the mean features of the genre's tracks, or None if it has none. '''
+        if not self.uris:
+            return None
+        width = len(features)
+        return [sum(self.features[j::width]) / len(self.uris) for j in range(width)]
+
+
+class GenreIndex:
+    ''' An in-memory index of the tracks of every genre, used to recommend tracks without asking Spotify. '''
+
+    def __init__(self):
+        self.pools = {}
+        self._lock = threading.Lock()
+
+    def add(self, tracks):
+        '''
+        Adds tracks to the index, or updates them if they are already in it.
+
+        Parameters:
+            - tracks (list): (genre, uri, popularity, speechiness, danceability, energy, valence,
+              acousticness, instrumentalness) tuples.
+        '''
+        with self._lock:
+            for genre, uri, popularity, speechiness, *track_features in tracks:
+                self.pools.setdefault(genre, GenrePool()).add(uri, popularity, speechiness, track_features)
+
+    def count(self, genre):
+        ''' Returns the number of playable tracks of a genre. '''
+        with self._lock:
+            pool = self.pools.get(genre)
+            return len(pool.playable()) if pool else 0
+
+    def genres(self):
+        with self._lock:
+            return sorted(self.pools)
+
+    def recommend(self, genres, counts, exclude=()):
+        '''
+        Picks random tracks from each genre. Popular tracks are more likely to be picked, and so are
+        tracks that sound like the mix of all the chosen genres, e.g. the more acoustic rock tracks
+        when rock is chosen together with folk.
+
+        Parameters:
+            - genres (list): The genres.
+            - counts (list): The number of tracks to pick from each genre.
+            - exclude (set): URIs that must not be picked.
+        Returns:
+            - A list of track URIs, at most counts[i] from genres[i].
+        '''
+        picked = []
+        exclude = set(exclude)
+        width = len(features)
+        with self._lock:
+            pools = [self.pools.get(genre) for genre in genres]
+            centroids = [pool.centroid() for pool in pools if pool]
+            if not centroids:
+                return picked
+            target = [sum(values) / len(centroids) for values in zip(*centroids)]
+
+            for pool, count in zip(pools, counts):
+                if pool is None:
+                    continue
+                weighted = []
+                for i in pool.playable():
+                    uri = pool.uris[i]
+                    if uri in exclude:
+                        continue
+                    distance = sum((value - goal) ** 2 for value, goal in zip(pool.features[i * width:(i + 1) * width], target))
+                    weighted.append(((pool.popularity[i] + 1) / (1 + similarity_weight * distance), uri))
+                for uri in sampling.weighted_sample(weighted, count):
+                    picked.append(uri)
+                    exclude.add(uri)
+        return picked
+
+
+index = GenreIndex()
+loader = sampling.IndexLoader(index, 'load_genre_tracks', 'save_genre_tracks', reload_interval)
+
+
+def count(genre):
+    ''' Returns the number of playable tracks of a genre in the index. '''
+    return loader.get().count(genre)
+
+
+def genres():
+    ''' Returns the genres that have tracks in the index. '''
+    return loader.get().genres()
+
+
+def recommend(genres, counts, exclude=()):
+    ''' Picks random tracks from each genre, see GenreIndex.recommend. '''
+    return loader.get().recommend(genres, counts, exclude)
+
+
+# Stores (genre, uri, popularity, speechiness, danceability, energy, valence, acousticness, instrumentalness)
+# tuples in the database and adds them to the index
+add_tracks = loader.add
@@ -0,0 +1,66 @@
+import heapq
+import random
+import threading
+import time
+import db
+
+# Tracks with at least this speechiness are mostly talk, and are never picked.
+max_speechiness = 0.7
+
+
+def weighted_sample(weighted_uris, count):
+    '''
+    Picks random URIs without replacement. URIs with a higher weight are more likely to be picked,
+    but every URI can be.
+
+    Parameters:
+        - weighted_uris (iterable): (weight, uri) pairs. Every weight must be above 0.
+        - count (int): The number of URIs to pick.
+    Returns:
+        - A list of at most count URIs.
+    '''
+    # Keep the count largest random()^(1/weight)
+    keyed = ((random.random() ** (1 / weight), uri) for weight, uri in weighted_uris)
+    return [uri for key, uri in heapq.nlargest(count, keyed)]
+
+
+class IndexLoader:
+    '''
+    Loads an in-memory track index from the database the first time it is used, and again
+    every reload_interval seconds to pick up tracks added by other workers.
+
+    The db functions are given by name and looked up in db.py on every call, so the timing
+    added by metrics.instrument_module is kept.
+
+    Parameters:
+        - index: The index. Its add method is given the rows returned by load.
+        - load (str): The name of the db function that returns every row of the index.
+        - save (str): The name of the db function that stores new rows.
+        - reload_interval (float): Seconds between reloads.
+    '''
+
+    def __init__(self, index, load, save, reload_interval):
+        self.index = index
+        self.load = load
+        self.save = save
+        self.reload_interval = reload_interval
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _is_old(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.reload_interval
+
+    def get(self):
+        ''' Returns the index, loading it from the database first if it is missing or old. '''
+        if self._is_old():
+            with self._lock:
+                if self._is_old():
+                    self.index.add(getattr(db, self.load)())
+                    self._loaded_at = time.monotonic()
+        return self.index
+
+    def add(self, rows):
+        ''' Stores rows in the database and adds them to the index. '''
+        if rows:
+            getattr(db, self.save)(rows)
+            self.get().add(rows)
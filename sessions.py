@@ -0,0 +1,127 @@
+import os
+import secrets
+from dotenv import load_dotenv
+from flask.sessions import SessionInterface, SessionMixin, session_json_serializer
+from itsdangerous import BadSignature, Signer
+from werkzeug.datastructures import CallbackDict
+import cache
+
+load_dotenv()
+
+# If set, sessions are kept in Redis and shared by every worker. Otherwise every worker keeps its own sessions,
+# so the app must then run in a single worker process, which gunicorn.conf.py enforces.
+redis_url = os.environ.get("REDIS_URL")
+# Seconds a session is kept after the user's last request
+session_ttl = int(os.environ.get("session_ttl", 7 * 24 * 60 * 60))
+# The maximum number of sessions kept in memory before the least recently used is evicted. An evicted
+# user is logged out without any warning, so this must stay above the number of users active within session_ttl.
+max_sessions = int(os.environ.get("session_max_entries", 10000))
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    ''' A session whose data is kept on the server. Only its ID is sent to the browser. '''
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # The stored ID the session had before rotate was called, which is deleted when the session is saved
+        self.old_sid = None
+
+    def rotate(self):
+        '''
+        Moves the session to a new ID, so an ID someone got hold of before e.g. a login
+        can't be used to reach the session after it.
+        '''
+        if self.old_sid is None and not self.new:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.modified = True
+
+    def clear(self):
+        super().clear()
+        self.rotate()
+
+
+def is_shared():
+    ''' Returns whether the sessions are kept in Redis, where every worker can read them. '''
+    return bool(redis_url) and cache.redis is not None
+
+
+def create_store():
+    '''
+    Returns a RedisCache for the sessions if REDIS_URL is set and the redis package is installed,
+    otherwise a MemoryCache.
+    '''
+    if is_shared():
+        return cache.RedisCache(redis_url, prefix='rr:session:')
+    return cache.MemoryCache(max_sessions)
+
+
+class ServerSideSessionInterface(SessionInterface):
+    '''
+    Keeps the session data in a server-side store, so the cookie only holds a signed session ID.
+    The OAuth token and the cached user info then don't travel with every request.
+    Sessions expire session_ttl seconds after the user's last request.
+    '''
+
+    serializer = session_json_serializer
+
+    def __init__(self, store=None):
+        self.store = store or create_store()
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='rhythmroulette-session')
+
+    def open_session(self, app, request):
+        if not app.secret_key:
+            return None
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            if sid:
+                data = self.store.get(sid)
+                # The store holds the serialized sessions as strings, and something else when the ID is unknown
+                if isinstance(data, str):
+                    return ServerSideSession(self.serializer.loads(data), sid=sid)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.old_sid is not None:
+            self.store.delete(session.old_sid)
+
+        if not session:
+            if not session.new and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+                response.vary.add('Cookie')
+            return
+
+        if session.modified:
+            self.store.set(session.sid, self.serializer.dumps(dict(session)), session_ttl)
+        else:
+            self.store.touch(session.sid, session_ttl)
+
+        if session.new or session.old_sid is not None or (session.modified and self.should_set_cookie(app, session)):
+            signed_sid = self._signer(app).sign(session.sid).decode()
+            response.set_cookie(name, signed_sid, expires=self.get_expiration_time(app, session),
+                                domain=domain, path=path, secure=secure, samesite=samesite, httponly=httponly)
+            response.vary.add('Cookie')
@@ -31,6 +31,33 @@ function updateSelectedGenres() {
     });
 }
 
+// Frågar servern om spellistan är klar tills jobbet är färdigt.
+function waitForPlaylist(response) {
+    if (!response.job_id) {
+        alert(response.message);
+        window.location.href = '/redirect-playlist';
+        return;
+    }
+    $.getJSON(response.status_url)
+        .done(function (job) {
+            if (job.status === 'done' || job.status === 'failed') {
+                alert(job.message);
+                window.location.href = '/redirect-playlist';
+            } else {
+                setTimeout(function () { waitForPlaylist(response); }, 1000);
+            }
+        })
+        .fail(function (jqXHR) {
+            // The job is gone or the user was logged out, so asking again won't help
+            if (jqXHR.status >= 400 && jqXHR.status < 500) {
+                alert((jqXHR.responseJSON && jqXHR.responseJSON.message) || "Spellistans status kunde inte hämtas.");
+                window.location.href = '/redirect-playlist';
+                return;
+            }
+            setTimeout(function () { waitForPlaylist(response); }, 1000);
+        });
+}
+
 $(document).ready(function () {
     var selectedGenres = [];
     var searchedGenres = [];
@@ -72,8 +99,7 @@ $(document).ready(function () {
                 contentType: 'application/json',
                 data: JSON.stringify({ genres: selectedGenres, recco_limit: $('#recco_limit').val() }),
                 success: function (response) {
-                    alert(response.message);
-                    window.location.href = '/redirect-playlist';
+                    waitForPlaylist(response);
                 },
                 error: function (xhr, status, error) {
                     // Handle error
@@ -86,8 +112,7 @@ $(document).ready(function () {
                 contentType: 'application/json',
                 data: JSON.stringify({ decades: searchedGenres, search_limit: $('#search_limit').val() }),
                 success: function (searchResponse) {
-                    alert(searchResponse.message);
-                    window.location.href = '/redirect-playlist';
+                    waitForPlaylist(searchResponse);
                 },
                 error: function (xhr, status, error) {
                     // Handle error
@@ -100,6 +125,97 @@ $(document).ready(function () {
 });
 
 
+// Laddar fler låtar på spellistsidan när användaren scrollar ner till knappen.
+$(document).ready(function () {
+    var loadMoreButton = $('#load-more-tracks');
+    if (loadMoreButton.length === 0) {
+        return;
+    }
+    var loading = false;
+
+    function trackCard(track) {
+        var card = $('<div class="card h-100"></div>');
+        card.append($('<img class="card-img-top" alt="Album Image">').attr('src', track.image));
+        var body = $('<div class="card-body"></div>');
+        body.append($('<h5 class="card-title"></h5>').text('Track: ' + track.name));
+        body.append($('<p class="card-text"></p>').text('Artist: ' + track.artist));
+        body.append($('<p class="card-text"></p>').text('Album: ' + track.album));
+        card.append(body);
+        return $('<div class="col-md-3 mb-4"></div>').append(card);
+    }
+
+    function loadMoreTracks() {
+        if (loading) {
+            return;
+        }
+        loading = true;
+        $.getJSON(loadMoreButton.data('url'), { offset: loadMoreButton.data('offset'), limit: loadMoreButton.data('limit') })
+            .done(function (response) {
+                response.tracks.forEach(function (track) {
+                    $('#playlist-tracks').append(trackCard(track));
+                });
+                if (response.next_offset === null) {
+                    loadMoreButton.remove();
+                } else {
+                    loadMoreButton.data('offset', response.next_offset);
+                }
+            })
+            .always(function () {
+                loading = false;
+            });
+    }
+
+    loadMoreButton.click(loadMoreTracks);
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver(function (entries) {
+            if (entries[0].isIntersecting) {
+                loadMoreTracks();
+            }
+        }).observe(loadMoreButton[0]);
+    }
+});
+
+// Hämtar äldre kommentarer på profilsidan.
+$(document).ready(function () {
+    var loadMoreButton = $('#load-more-comments');
+    if (loadMoreButton.length === 0) {
+        return;
+    }
+
+    function commentRow(comment) {
+        var row = $('<p></p>');
+        row.append($('<strong></strong>').text(comment.user_one));
+        row.append(document.createTextNode(': ' + comment.u_comment + ' '));
+        row.append($('<small></small>').text(comment.formatted_date));
+        if (comment.delete_url) {
+            var form = $('<form method="post" class="d-inline"></form>').attr('action', comment.delete_url);
+            form.append('<button type="submit" class="btn btn-link btn-sm">Ta bort</button>');
+            row.append(form);
+        }
+        return row;
+    }
+
+    loadMoreButton.click(function () {
+        loadMoreButton.prop('disabled', true);
+        $.getJSON(loadMoreButton.data('url'), { before: loadMoreButton.data('before'), before_id: loadMoreButton.data('before-id') })
+            .done(function (response) {
+                response.comments.forEach(function (comment) {
+                    $('#comments-container').append(commentRow(comment));
+                });
+                var last = response.comments[response.comments.length - 1];
+                if (!response.more_comments || !last) {
+                    loadMoreButton.remove();
+                    return;
+                }
+                loadMoreButton.data('before', last.c_date);
+                loadMoreButton.data('before-id', last.c_id);
+            })
+            .always(function () {
+                loadMoreButton.prop('disabled', false);
+            });
+    });
+});
+
 const myModal = document.getElementById('myModal')
 const myInput = document.getElementById('myInput')
 
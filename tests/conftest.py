@@ -0,0 +1,27 @@
+import os
+import sys
+import pytest
+
+# The tests import the app's modules from the repository's root folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import mock_spotify, run  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def spotify():
+    ''' The mock Spotify server from the benchmark, which main.py is configured to use. '''
+    server = mock_spotify.MockSpotify(latency=0, jitter=0)
+    run.load_app(server.start())
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client(spotify, monkeypatch):
+    ''' A test client of the app, logged in as benchuser1. '''
+    import main
+    monkeypatch.setattr(main.db, 'register_user', lambda *args: None)
+    client = main.app.test_client()
+    client.get('/callback?code=benchuser1')
+    return client
@@ -0,0 +1,137 @@
+import threading
+import time
+from types import SimpleNamespace
+import psycopg2
+import pytest
+from psycopg2 import extensions, pool
+import db
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def execute(self, query, params=None):
+        if self.connection.dropped:
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+
+
+class FakeConnection:
+    ''' Stands in for a psycopg2 connection. dropped makes it fail like a connection the server has closed. '''
+
+    def __init__(self):
+        self.closed = 0
+        self.dropped = False
+        self.info = SimpleNamespace(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        if self.dropped:
+            raise psycopg2.InterfaceError("connection already closed")
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    ''' Makes the pool create FakeConnections, and returns the list of connections it has created. '''
+    created = []
+
+    def connect(*args, **kwargs):
+        created.append(FakeConnection())
+        return created[-1]
+
+    monkeypatch.setattr(psycopg2, 'connect', connect)
+    monkeypatch.setattr(db, 'connection_pool', None)
+    monkeypatch.setattr(db, '_last_used', {})
+    return created
+
+
+def use_slots(monkeypatch, slots, timeout=5):
+    monkeypatch.setattr(db, 'min_connections', 1)
+    monkeypatch.setattr(db, 'max_connections', slots)
+    monkeypatch.setattr(db, '_pool_slots', threading.BoundedSemaphore(slots))
+    monkeypatch.setattr(db, 'checkout_timeout', timeout)
+
+
+def test_threads_wait_for_a_free_connection(monkeypatch, connections):
+    use_slots(monkeypatch, 3)
+    active = []
+    most_active = []
+    errors = []
+    lock = threading.Lock()
+
+    def work():
+        try:
+            with db.get_cursor() as cur:
+                with lock:
+                    active.append(cur.connection)
+                    most_active.append(len(active))
+                time.sleep(0.01)
+                with lock:
+                    active.remove(cur.connection)
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=work) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(most_active) == 20
+    assert max(most_active) <= 3
+
+
+def test_checkout_times_out_when_every_connection_is_in_use(monkeypatch, connections):
+    use_slots(monkeypatch, 1, timeout=0.05)
+    with db.get_cursor():
+        with pytest.raises(pool.PoolError):
+            with db.get_cursor():
+                pass
+    # The slot is free again once the first call is done
+    with db.get_cursor():
+        pass
+
+
+def test_dropped_idle_connection_is_replaced(monkeypatch, connections):
+    use_slots(monkeypatch, 2)
+    # Ping every connection before it is handed out
+    monkeypatch.setattr(db, 'health_check_interval', 0)
+    with db.get_cursor() as cur:
+        first = cur.connection
+    first.dropped = True
+
+    with db.get_cursor() as cur:
+        second = cur.connection
+    assert second is not first
+    assert first.closed
+    assert first not in db.connection_pool._pool
+
+
+def test_connection_dropped_during_a_call_is_discarded(monkeypatch, connections):
+    use_slots(monkeypatch, 2)
+    with pytest.raises(psycopg2.OperationalError):
+        with db.get_cursor() as cur:
+            first = cur.connection
+            first.dropped = True
+            first.closed = 2
+            cur.execute('SELECT 1')
+
+    with db.get_cursor() as cur:
+        assert cur.connection is not first
+    # Both calls gave their slots back
+    assert db._pool_slots.acquire(timeout=0) and db._pool_slots.acquire(timeout=0)
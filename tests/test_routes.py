@@ -0,0 +1,65 @@
+from datetime import datetime
+
+
+def test_users_cannot_befriend_themselves(client, monkeypatch):
+    import main
+    befriended = []
+    monkeypatch.setattr(main.db, 'check_if_friends', lambda user_1, user_2: False)
+    monkeypatch.setattr(main.db, 'become_friends', lambda user_1, user_2: befriended.append((user_1, user_2)))
+
+    response = client.get('/become-friends/benchuser1/benchuser1')
+
+    assert response.status_code == 302
+    assert befriended == []
+
+
+def test_comment_pages_need_a_valid_position(client, monkeypatch):
+    import main
+    pages = []
+    monkeypatch.setattr(main.db, 'get_user_comments', lambda user_id, limit, before=None: pages.append(before) or [])
+
+    for query in ('before=2024-05-01T12:00:00', 'before_id=5', 'before=yesterday&before_id=5', 'before=2024-05-01T12:00:00&before_id=x'):
+        assert client.get(f'/profile-page/benchuser2/comments?{query}').status_code == 400
+    assert pages == []
+
+    assert client.get('/profile-page/benchuser2/comments').status_code == 200
+    assert client.get('/profile-page/benchuser2/comments?before=2024-05-01T12:00:00.123456&before_id=5').status_code == 200
+    assert pages == [None, (datetime(2024, 5, 1, 12, 0, 0, 123456), 5)]
+
+
+def test_deleted_users_are_removed_from_their_friends_cached_friends(client, monkeypatch):
+    import main
+    friends = {'benchuser1': ['benchuser2'], 'benchuser2': ['benchuser1']}
+    monkeypatch.setattr(main.db, 'list_friends', lambda user_id: list(friends[user_id]))
+    monkeypatch.setattr(main.db, 'check_user_in_db', lambda user_id: True)
+    monkeypatch.setattr(main.db, 'delete_user', lambda user_id: friends.update({'benchuser2': []}))
+    assert main.get_friends('benchuser2') == ['benchuser1']
+
+    response = client.post('/delete-profile')
+
+    assert response.status_code == 302
+    assert main.get_friends('benchuser2') == []
+
+
+def session_id(client):
+    import main
+    cookie = client.get_cookie(main.app.config['SESSION_COOKIE_NAME'])
+    return main.app.session_interface._signer(main.app).unsign(cookie.value).decode() if cookie else None
+
+
+def test_logging_in_and_out_moves_the_session_to_a_new_id(client):
+    import main
+    store = main.app.session_interface.store
+    old_sid = session_id(client)
+
+    client.get('/callback?code=benchuser1')
+    new_sid = session_id(client)
+
+    assert new_sid != old_sid
+    assert not isinstance(store.get(old_sid), str)
+    assert isinstance(store.get(new_sid), str)
+
+    client.get('/logout')
+
+    assert session_id(client) is None
+    assert not isinstance(store.get(new_sid), str)
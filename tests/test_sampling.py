@@ -0,0 +1,40 @@
+import catalog
+import recommender
+import sampling
+
+
+def test_weighted_sample_picks_distinct_uris():
+    picked = sampling.weighted_sample([(1, 'a'), (50, 'b'), (100, 'c')], 2)
+    assert len(picked) == 2
+    assert len(set(picked)) == 2
+    assert sampling.weighted_sample([(1, 'a')], 5) == ['a']
+
+
+def test_loader_loads_once_until_the_reload_interval_has_passed(monkeypatch):
+    loads = []
+
+    class Index:
+        def add(self, rows):
+            loads.append(rows)
+
+    monkeypatch.setattr(sampling.db, 'load_track_catalog', lambda: ['row'])
+    loader = sampling.IndexLoader(Index(), 'load_track_catalog', 'save_catalog_tracks', reload_interval=60)
+    loader.get()
+    loader.get()
+    assert loads == [['row']]
+
+    loader.reload_interval = -1
+    loader.get()
+    assert len(loads) == 2
+
+
+def test_catalog_and_genre_pools_skip_tracks_that_are_mostly_talk(monkeypatch):
+    monkeypatch.setattr(sampling.db, 'load_track_catalog', lambda: [('talk', 1990, 100, 0.9),
+                                                                   ('song', 1995, 10, 0.1)])
+    monkeypatch.setattr(catalog, 'loader', sampling.IndexLoader(catalog.TrackIndex(), 'load_track_catalog', 'save_catalog_tracks', 60))
+    assert catalog.sample('1990-1999', 2) == ['song']
+
+    index = recommender.GenreIndex()
+    index.add([('rock', 'talk', 100, 0.9, 0.5, 0.5, 0.5, 0.5, 0.5),
+               ('rock', 'song', 10, 0.1, 0.5, 0.5, 0.5, 0.5, 0.5)])
+    assert index.recommend(['rock'], [2]) == ['song']
@@ -0,0 +1,127 @@
+import time
+
+
+def test_rate_limited_requests_are_retried(spotify, client, monkeypatch):
+    # Allow one request per second, with the first second's request already used up
+    monkeypatch.setattr(spotify, 'rate_limit', 1)
+    monkeypatch.setattr(spotify, '_allowance', 0)
+    monkeypatch.setattr(spotify, '_last_check', time.monotonic())
+    rate_limited = spotify.rate_limited
+
+    response = client.get('/playlist/benchuser1pl0/tracks')
+
+    assert response.status_code == 200
+    assert response.json['tracks']
+    assert spotify.rate_limited > rate_limited
+
+
+
+def connection_pools(adapter):
+    return [adapter.poolmanager.pools[key] for key in adapter.poolmanager.pools.keys()]
+
+
+def test_requests_reuse_pooled_connections(spotify, client):
+    import main
+    adapter = main.spotify_session.get_adapter(main.spotify_api_url)
+
+    client.get('/playlist/benchuser1pl0/tracks')
+    pools = connection_pools(adapter)
+    assert len(pools) == 1
+    opened = pools[0].num_connections
+    client.get('/playlist/benchuser1pl1/tracks')
+
+    # The second request was sent on a kept-alive connection of the same pool
+    assert connection_pools(adapter) == pools
+    assert pools[0].num_connections == opened
+
+
+def test_clients_refresh_a_token_that_expires_while_in_use(spotify, client):
+    import main
+    with client.session_transaction() as session:
+        token_info = session['token_info']
+
+    with main.app.test_request_context():
+        main.session['token_info'] = token_info
+        spotify_client = main.get_spotify()
+        # The token expires while the client is still in use, as in a long background job
+        main.session['token_info'] = dict(token_info, expires_at=0)
+        spotify.tokens[token_info['access_token']] = ('benchuser1', 0)
+
+        assert spotify_client.me()['id'] == 'benchuser1'
+        assert main.session['token_info']['access_token'] != token_info['access_token']
+
+
+def playlist_writes(spotify):
+    return sum(count for rule, count in spotify.requests.items() if rule.startswith('/v1/playlists/<playlist_id>/'))
+
+
+def write_tracks(main, client, playlist_id, track_list):
+    with client.session_transaction() as session:
+        token_info = session['token_info']
+    with main.app.test_request_context():
+        main.session['token_info'] = token_info
+        return main.write_generated_tracks(playlist_id, 'Test', track_list)
+
+
+def test_rate_limited_playlist_writes_are_chunked_in_order(spotify, client, monkeypatch):
+    import main
+    saved, delays = [], []
+    monkeypatch.setattr(main, 'save_generated_playlist', lambda *args: saved.append(args))
+    retry_delay = main.retry_delay
+    monkeypatch.setattr(main, 'retry_delay', lambda error, attempt: delays.append(error.http_status) or retry_delay(error, attempt))
+    # One write per second, so every chunk after the first is rate limited once
+    monkeypatch.setattr(spotify, 'rate_limit', 1)
+    monkeypatch.setattr(spotify, '_allowance', 1)
+    monkeypatch.setattr(spotify, '_last_check', time.monotonic())
+    track_list = [f'spotify:track:track{n}' for n in range(250)]
+    writes = playlist_writes(spotify)
+
+    message = write_tracks(main, client, 'writetest', track_list)
+
+    assert message == "Spellista skapad!"
+    assert spotify.playlist_tracks['writetest'] == track_list
+    assert saved == [('writetest', 'Test', 250)]
+    # Every 429 was retried once by add_tracks_to_playlist, and never by the HTTP adapter
+    assert delays and set(delays) == {429}
+    assert playlist_writes(spotify) - writes == 3 + len(delays)
+
+
+def test_playlist_writes_that_keep_failing_keep_the_added_tracks(spotify, client, monkeypatch):
+    import main
+    saved = []
+    monkeypatch.setattr(main, 'save_generated_playlist', lambda *args: saved.append(args))
+    monkeypatch.setattr(main, 'playlist_write_retries', 0)
+    monkeypatch.setattr(spotify, 'rate_limit', 1)
+    monkeypatch.setattr(spotify, '_allowance', 1)
+    monkeypatch.setattr(spotify, '_last_check', time.monotonic())
+    track_list = [f'spotify:track:track{n}' for n in range(250)]
+    writes = playlist_writes(spotify)
+
+    message = write_tracks(main, client, 'partialtest', track_list)
+
+    assert message == "Bara 100 av 250 låtar kunde läggas till i spellistan. Försök igen lite senare."
+    assert spotify.playlist_tracks['partialtest'] == track_list[:100]
+    assert saved == [('partialtest', 'Test', 100)]
+    assert playlist_writes(spotify) - writes == 2
+
+
+def test_years_are_sampled_from_the_catalog_when_spotify_fails(spotify, monkeypatch):
+    import main
+    from spotipy import SpotifyException
+
+    class FailingSpotify:
+        def search(self, *args, **kwargs):
+            raise SpotifyException(503, -1, 'Service unavailable')
+
+    written = []
+    monkeypatch.setattr(main, 'sp', FailingSpotify())
+    monkeypatch.setattr(main.catalog, 'count', lambda year_range: 0)
+    monkeypatch.setattr(main.catalog, 'sample', lambda year_range, count, exclude: ['spotify:track:track1'])
+    monkeypatch.setattr(main, 'write_generated_tracks', lambda *args: written.append(args) or "Spellista skapad!")
+
+    # Generation jobs run with a copy of the request context that started them
+    with main.app.test_request_context():
+        message = main.generate_from_years(lambda done, total: None, 'yearstest', 'Test', ['1990-1999'], '10')
+
+    assert message == "Spellista skapad!"
+    assert written == [('yearstest', 'Test', ['spotify:track:track1'])]
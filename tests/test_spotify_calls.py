@@ -0,0 +1,74 @@
+from datetime import timedelta
+import pytest
+import db
+
+# The most Spotify requests each page may make for a logged in user, when the data it shows is
+# already stored in the database. A page that asks Spotify for more than this fails the test.
+budgets = {
+    '/': 0,
+    '/profile-page': 0,
+    '/profile-page/benchuser1': 1,
+    '/profile-page/benchuser2': 1,
+    '/profile-page/benchuser1/playlists': 0,
+    '/profile-settings': 0,
+    '/users': 0,
+    '/playlist/benchuser1pl0': 2,
+    '/playlist/benchuser1pl0/tracks': 1,
+    '/top/tracks?time_range=short_term': 0,
+    '/top/artists?time_range=long_term': 0,
+    '/recommendations': 1,
+    '/search': 0,
+}
+
+
+def spotify_calls(spotify):
+    ''' Returns the number of Web API requests the mock Spotify server has answered. '''
+    return sum(count for rule, count in spotify.requests.items() if rule.startswith('/v1/'))
+
+
+@pytest.fixture
+def stored_data(monkeypatch):
+    ''' Stands in for the database with up to date rows for every page. '''
+    import main
+    monkeypatch.setattr(main.db, 'load_profile', lambda user_id, viewer_id, limit: db.Profile(user_id, '2024-01-01 12:00'))
+    monkeypatch.setattr(main.db, 'list_friends', lambda user_id: [])
+    monkeypatch.setattr(main.db, 'friend_suggestions', lambda user_id, limit: [])
+    monkeypatch.setattr(main.db, 'check_playlist', lambda user_id: [('benchuser1pl0', 'Playlist 0', timedelta(minutes=5))])
+    monkeypatch.setattr(main.db, 'check_if_playlist_is_own', lambda pl_id: 'benchuser1')
+    monkeypatch.setattr(main.db, 'get_top_items_snapshot',
+                        lambda user_id, item_type, time_range: (timedelta(minutes=5), [{'id': 'track1', 'name': 'Track 1', 'artists': []}]))
+
+
+@pytest.mark.parametrize('url, budget', budgets.items())
+def test_spotify_calls_per_page(spotify, client, stored_data, url, budget):
+    calls = spotify_calls(spotify)
+    response = client.get(url)
+
+    assert response.status_code in (200, 302)
+    assert spotify_calls(spotify) - calls <= budget
+
+
+def test_profile_page_redirect_makes_no_calls(spotify, client, monkeypatch):
+    import main
+    monkeypatch.setattr(main, 'db', None)
+    calls = spotify_calls(spotify)
+
+    response = client.get('/profile-page')
+
+    assert response.status_code == 302
+    assert response.location.endswith('/profile-page/benchuser1')
+    assert spotify_calls(spotify) == calls
+
+
+def test_old_top_items_are_fetched_once(spotify, client, stored_data, monkeypatch):
+    import main
+    saved = []
+    monkeypatch.setattr(main.db, 'get_top_items_snapshot', lambda user_id, item_type, time_range: None)
+    monkeypatch.setattr(main.db, 'save_top_items_snapshot', lambda *args: saved.append(args))
+    calls = spotify_calls(spotify)
+
+    response = client.get('/top/tracks?time_range=medium_term')
+
+    assert response.status_code == 200
+    assert spotify_calls(spotify) - calls == 1
+    assert len(saved) == 1